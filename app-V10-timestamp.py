@@ -2,8 +2,10 @@ import os
 import re
 import json
 import random
+import uuid
 from datetime import datetime
 from flask import Flask, request, render_template_string, session, redirect, url_for
+from leaderboard_store import JsonJournalLeaderboardStore
 
 app = Flask(__name__, static_url_path="/static", static_folder="E:/temp/temp")
 app.secret_key = "your_secret_key"  # 必須設定，以使用 session
@@ -15,22 +17,9 @@ QA_FILE_PATH = "E:/temp/temp/QA.txt"        # 題目檔案路徑
 LEADERBOARD_FILE_PATH = "E:/temp/temp/leaderboard.json"  # 排行榜檔案路徑
 
 # ------------------------------
-# 2. 排行榜存取函式
+# 2. 排行榜存取 (append-only 日誌，定期合併回 leaderboard.json)
 # ------------------------------
-def load_leaderboard(file_path):
-    """從 JSON 檔案中讀取排行榜資料"""
-    if os.path.exists(file_path):
-        with open(file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return []
-
-def save_leaderboard(file_path, data):
-    """將排行榜資料以 JSON 格式寫回檔案"""
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
-
-# 初始化全域排行榜（程式啟動時讀取一次）
-leaderboard = load_leaderboard(LEADERBOARD_FILE_PATH)
+leaderboard_store = JsonJournalLeaderboardStore(LEADERBOARD_FILE_PATH)
 
 # ------------------------------
 # 3. 載入題目
@@ -360,14 +349,12 @@ def submit():
         from datetime import datetime
         now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        leaderboard.append({
+        leaderboard_store.append(uuid.uuid4().hex, {
             "name": session['player_name'],
             "score": total_score,
             "level": level,
             "timestamp": now_str   # 新增時間欄位
         })
-        leaderboard.sort(key=lambda x: x['score'], reverse=True)
-        save_leaderboard(LEADERBOARD_FILE_PATH, leaderboard)
 
     return render_template_string(
         result_template,
@@ -383,7 +370,7 @@ def submit():
 
 @app.route("/ranking")
 def ranking():
-    return render_template_string(ranking_template, ranking=leaderboard)
+    return render_template_string(ranking_template, ranking=list(leaderboard_store))
 
 # ------------------------------
 # 6. 主程式啟動
@@ -1,12 +1,26 @@
 import os
 import re
+import io
+import csv
 import json
-import random
-import base64
-from datetime import datetime
-from flask import Flask, request, render_template, session, redirect, url_for
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import uuid
+import atexit
+import threading
+from datetime import date, datetime
+from flask import Flask, Response, request, render_template, session, redirect, url_for
+from sheets import SheetsClientManager, SheetsGuard, GuardedWorksheet, SHEETS_ERRORS, reset_on_error
+from fake_sheets import FakeWorksheet, FakeSheetsManager
+from leaderboard_cache import LeaderboardCache, PageRenderCache, appended_row_numbers, parse_leaderboard_rows
+from leaderboard_writer import CommittedGameIndex, LeaderboardWriter, ResultSpool
+from leaderboard_store import (
+    SheetsLeaderboardStore, SQLiteLeaderboardStore, JsonJournalLeaderboardStore, row_to_record
+)
+from leaderboard_index import RankingIndex, ScoreBucketIndex, ColumnarLeaderboard
+from leaderboard_snapshot import SnapshotLeaderboardStore
+from question_deck import new_seed, draw_questions, choice_order
+from question_bank import QuizBankRegistry
+from session_store import (ServerSideSessionInterface, MemorySessionBackend, SQLiteSessionBackend,
+                           RedisSessionBackend)
 
 # ---------------------------------------
 # Google Sheet 參數 (請自行調整)
@@ -15,24 +29,153 @@ SHEET_NAME = "Dr-Veggie-Leaderboard"   # 您的 Google Sheet 名稱
 WORKSHEET_NAME = "Leaderboard"         # 工作表名稱
 ENV_VAR_FOR_SERVICE_ACCOUNT = "GSPREAD_SERVICE_ACCOUNT_B64"  # 環境變數名稱
 
-def get_gspread_client_from_env():
-    sa_base64 = os.environ.get(ENV_VAR_FOR_SERVICE_ACCOUNT, "")
-    if not sa_base64:
-        raise ValueError(f"找不到環境變數 {ENV_VAR_FOR_SERVICE_ACCOUNT}，請先設定！")
-    sa_json = base64.b64decode(sa_base64).decode("utf-8")
-    sa_dict = json.loads(sa_json)
-    scope = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive"
-    ]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(sa_dict, scope)
-    return gspread.authorize(creds)
+# google：連線真正的 Google Sheet；fake：使用記憶體中的替身 (離線測試、壓力測試)
+SHEETS_BACKEND = os.environ.get("SHEETS_BACKEND", "google")
+
+def optional_int(value):
+    return int(value) if value else None
+
+if SHEETS_BACKEND == "fake":
+    sheets_manager = FakeSheetsManager(FakeWorksheet(
+        title=WORKSHEET_NAME,
+        latency=float(os.environ.get("FAKE_SHEETS_LATENCY", "0")),
+        error_rate=float(os.environ.get("FAKE_SHEETS_ERROR_RATE", "0")),
+        read_quota=optional_int(os.environ.get("FAKE_SHEETS_READ_QUOTA")),
+        write_quota=optional_int(os.environ.get("FAKE_SHEETS_WRITE_QUOTA"))
+    ))
+elif SHEETS_BACKEND == "google":
+    sheets_manager = SheetsClientManager(SHEET_NAME, WORKSHEET_NAME, ENV_VAR_FOR_SERVICE_ACCOUNT)
+else:
+    raise ValueError(f"未知的 Google Sheet 後端：{SHEETS_BACKEND}")
+
+# 所有 Google Sheet 呼叫的每分鐘預算、退避重試與斷路器設定
+sheets_guard = SheetsGuard(
+    requests_per_minute=int(os.environ.get("SHEETS_REQUESTS_PER_MINUTE", "50")),
+    failure_threshold=int(os.environ.get("SHEETS_BREAKER_THRESHOLD", "5")),
+    reset_timeout=float(os.environ.get("SHEETS_BREAKER_RESET", "30")),
+    # 授權失效或找不到試算表時丟棄快取的連線與 Worksheet
+    on_error=lambda exc: reset_on_error(sheets_manager, exc)
+)
 
 def open_worksheet():
-    client = get_gspread_client_from_env()
-    spreadsheet = client.open(SHEET_NAME)
-    ws = spreadsheet.worksheet(WORKSHEET_NAME)
-    return ws
+    ws = sheets_manager.cached_worksheet or sheets_guard.call(sheets_manager.worksheet)
+    return GuardedWorksheet(ws, sheets_guard)
+
+# 排行榜快取秒數，過期後才重新讀取 Google Sheet
+RANKING_CACHE_TTL = int(os.environ.get("RANKING_CACHE_TTL", "60"))
+# 排行榜索引：columnar (欄式儲存，預設，百萬筆以上時記憶體用量遠低於每筆一個 dict)、
+# bucket (分數計數排序) 或 sorted (一般排序索引)
+RANKING_INDEX = os.environ.get("RANKING_INDEX", "columnar")
+RANKING_INDEX_TYPES = {"bucket": ScoreBucketIndex, "sorted": RankingIndex, "columnar": ColumnarLeaderboard}
+# 距上次完整下載超過此秒數才重新讀取整張工作表，其餘只抓新增的列
+RANKING_FULL_RELOAD_INTERVAL = int(os.environ.get("RANKING_FULL_RELOAD_INTERVAL", "600"))
+leaderboard_cache = LeaderboardCache(
+    open_worksheet,
+    RANKING_CACHE_TTL,
+    index_factory=RANKING_INDEX_TYPES[RANKING_INDEX],
+    full_reload_interval=RANKING_FULL_RELOAD_INTERVAL,
+    # 快取過期時先回傳舊資料，背景只發出一個同步請求
+    stale_while_revalidate=os.environ.get("RANKING_STALE_WHILE_REVALIDATE", "1") == "1"
+)
+
+# ---------------------------------------
+# 本機資料目錄 (已提交遊戲索引等)
+# ---------------------------------------
+DATA_DIR = os.environ.get("DRVEGGIE_DATA_DIR", "data")
+os.makedirs(DATA_DIR, exist_ok=True)
+committed_games = CommittedGameIndex(os.path.join(DATA_DIR, "committed_games.db"))
+
+# 成績先寫入本機暫存檔 (fsync) 再交給排行榜後端，逾時未確認的會定期重播
+result_spool = ResultSpool(os.path.join(DATA_DIR, "results.spool"))
+SPOOL_REPLAY_INTERVAL = float(os.environ.get("SPOOL_REPLAY_INTERVAL", "60"))
+SPOOL_REPLAY_MIN_AGE = float(os.environ.get("SPOOL_REPLAY_MIN_AGE", "300"))
+
+# ---------------------------------------
+# 排行榜背景寫入 (玩家不需等待 Google API)
+# ---------------------------------------
+LEADERBOARD_QUEUE_SIZE = int(os.environ.get("LEADERBOARD_QUEUE_SIZE", "1000"))
+LEADERBOARD_BATCH_SIZE = int(os.environ.get("LEADERBOARD_BATCH_SIZE", "50"))          # 每批最多筆數
+LEADERBOARD_FLUSH_INTERVAL = float(os.environ.get("LEADERBOARD_FLUSH_INTERVAL", "2"))  # 合併等待秒數
+
+def append_leaderboard_rows(rows):
+    # 回傳新增各列的工作表列號，讓快取以列號對帳 (與背景同步交錯時不會重複計入)
+    return appended_row_numbers(open_worksheet().append_rows(rows), len(rows))
+
+def on_leaderboard_committed(game_id, row, row_number):
+    leaderboard_cache.add(row_to_record(row), row_number)
+    result_spool.ack(game_id)
+
+def on_leaderboard_failed(game_id, row, exc):
+    # 成績仍在暫存檔中，之後由重播程序再寫一次
+    committed_games.release(game_id)
+
+leaderboard_writer = LeaderboardWriter(
+    append_leaderboard_rows,
+    maxsize=LEADERBOARD_QUEUE_SIZE,
+    batch_size=LEADERBOARD_BATCH_SIZE,
+    flush_interval=LEADERBOARD_FLUSH_INTERVAL,
+    on_committed=on_leaderboard_committed,
+    on_failed=on_leaderboard_failed
+)
+atexit.register(leaderboard_writer.close)
+
+# ---------------------------------------
+# 排行榜儲存後端
+#   sqlite：本機 SQLite 為主，有設定 Google 憑證時再非同步備份到 Google Sheet
+#   sheets：直接以 Google Sheet 為主
+#   json  ：本機 leaderboard.json + append-only 日誌
+# ---------------------------------------
+LEADERBOARD_BACKEND = os.environ.get("LEADERBOARD_BACKEND", "sqlite")
+SHEETS_ENABLED = SHEETS_BACKEND == "fake" or bool(os.environ.get(ENV_VAR_FOR_SERVICE_ACCOUNT))
+
+def hydrate_from_sheets(store):
+    """本機資料庫尚未匯入過時，從 Google Sheet 匯入既有成績 (多個 worker 中只會有一個真正寫入)"""
+    try:
+        imported = store.import_records(parse_leaderboard_rows(open_worksheet().get_all_values()))
+        if imported:
+            print(f"已從 Google Sheet 匯入 {imported} 筆排行榜紀錄")
+    except Exception as exc:
+        print(f"從 Google Sheet 匯入排行榜失敗：{exc}")
+
+def build_leaderboard_store():
+    if LEADERBOARD_BACKEND == "sheets":
+        return SheetsLeaderboardStore(leaderboard_cache, leaderboard_writer, committed_games)
+    if LEADERBOARD_BACKEND == "sqlite":
+        store = SQLiteLeaderboardStore(
+            os.path.join(DATA_DIR, "leaderboard.db"),
+            mirror=leaderboard_writer if SHEETS_ENABLED else None
+        )
+        if SHEETS_ENABLED and store.needs_import():
+            threading.Thread(target=hydrate_from_sheets, args=(store,), daemon=True).start()
+        return store
+    if LEADERBOARD_BACKEND == "json":
+        return JsonJournalLeaderboardStore(
+            os.environ.get("LEADERBOARD_FILE_PATH", "leaderboard.json"),
+            index_factory=RANKING_INDEX_TYPES[RANKING_INDEX]
+        )
+    raise ValueError(f"未知的排行榜後端：{LEADERBOARD_BACKEND}")
+
+leaderboard_store = build_leaderboard_store()
+
+# 已渲染的排行榜頁面，依排行榜版本快取
+ranking_page_cache = PageRenderCache(
+    max_bytes=int(os.environ.get("RANKING_RENDER_CACHE_BYTES", str(8 * 1024 * 1024)))
+)
+
+# 多個 gunicorn worker 時建議開啟：由一個程序發布 mmap 快照，所有 worker 共用讀取
+if os.environ.get("LEADERBOARD_SNAPSHOT", "0") == "1":
+    leaderboard_store = SnapshotLeaderboardStore(
+        leaderboard_store,
+        os.path.join(DATA_DIR, "leaderboard.snapshot"),
+        interval=float(os.environ.get("LEADERBOARD_SNAPSHOT_INTERVAL", "2"))
+    )
+
+def replay_result(game_id, record):
+    leaderboard_store.replay(game_id, record)
+    if not leaderboard_store.commits_async:
+        result_spool.ack(game_id)
+
+result_spool.start_replayer(replay_result, interval=SPOOL_REPLAY_INTERVAL, min_age=SPOOL_REPLAY_MIN_AGE)
 
 # ---------------------------------------
 # Flask App 初始化
@@ -40,6 +183,28 @@ def open_worksheet():
 app = Flask(__name__, static_url_path="/static", static_folder="static")
 app.secret_key = "your_secret_key"  # 請替換成安全的金鑰
 
+# ---------------------------------------
+# Session 儲存位置
+#   sqlite：本機 SQLite，同一台機器的 worker 共用 (預設)
+#   memory：單一程序的 LRU，只適用單一 worker
+#   redis ：Redis 或相容伺服器 (SESSION_REDIS_URL)
+#   cookie：Flask 預設的簽章 cookie，整份遊戲狀態都放在 cookie
+# ---------------------------------------
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite")
+SESSION_TTL = int(os.environ.get("SESSION_TTL", str(6 * 60 * 60)))
+
+def build_session_backend():
+    if SESSION_BACKEND == "sqlite":
+        return SQLiteSessionBackend(os.path.join(DATA_DIR, "sessions.db"))
+    if SESSION_BACKEND == "memory":
+        return MemorySessionBackend(int(os.environ.get("SESSION_MEMORY_MAX", "10000")))
+    if SESSION_BACKEND == "redis":
+        return RedisSessionBackend(os.environ.get("SESSION_REDIS_URL", "redis://localhost:6379/0"))
+    raise ValueError(f"未知的 session 後端：{SESSION_BACKEND}")
+
+if SESSION_BACKEND != "cookie":
+    app.session_interface = ServerSideSessionInterface(build_session_backend(), ttl=SESSION_TTL)
+
 # ---------------------------------------
 # 讀取題目資料 (假設檔案 QA.txt 與特定格式)
 # ---------------------------------------
@@ -47,38 +212,23 @@ QA_FILE_PATH = "QA.txt"
 if not os.path.exists(QA_FILE_PATH):
     raise FileNotFoundError(f"找不到 QA.txt：{QA_FILE_PATH}")
 
-def load_quiz_data_from_txt(file_path):
-    quiz_list = []
-    pattern = re.compile(
-        r'^\(\s*(\d+)\s*,\s*'
-        r"'([^']*)'\s*,\s*"
-        r"'([^']*)'\s*,\s*"
-        r"'([^']*)'\s*,\s*"
-        r"'([^']*)'\s*,\s*"
-        r"'([^']*)'\s*\),?"
-    )
-    with open(file_path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            match = pattern.match(line)
-            if not match:
-                raise ValueError(f"行格式不符：{line}")
-            question_text = match.group(2)
-            choices = [match.group(3), match.group(4), match.group(5)]
-            author = match.group(6)
-            correct_answer = match.group(3)
-            random.shuffle(choices)
-            quiz_list.append({
-                "q": question_text,
-                "choices": choices,
-                "answer": correct_answer,
-                "author": author
-            })
-    return quiz_list
-
-quiz_data = load_quiz_data_from_txt(QA_FILE_PATH)
+# 解析後的題庫快取 (設為空字串則不使用快取)
+QA_CACHE_PATH = os.environ.get("QA_CACHE_PATH", os.path.join(DATA_DIR, "qa.bank")) or None
+# 每隔幾秒檢查 QA.txt 是否有變動，有變動就在背景換上新題庫 (0 表示不檢查)
+QA_RELOAD_INTERVAL = float(os.environ.get("QA_RELOAD_INTERVAL", "2"))
+
+quiz_banks = QuizBankRegistry(
+    QA_FILE_PATH,
+    QA_CACHE_PATH,
+    # 舊版本題庫另存一份，其他 worker 也能取回進行中遊戲的題庫
+    archive_dir=os.path.join(DATA_DIR, "qa_versions")
+)
+if QA_RELOAD_INTERVAL > 0:
+    quiz_banks.start_watcher(QA_RELOAD_INTERVAL)
+
+def game_bank():
+    """目前遊戲開始時的題庫版本；已無法取得時回傳 None"""
+    return quiz_banks.get(session.get('bank_version'))
 
 def get_time_limit(level):
     base_time = 40
@@ -98,12 +248,18 @@ def start_game():
     if not re.match(r'^[A-Za-z0-9一-龥]{1,10}$', player_name):
         return "<p>姓名格式錯誤。<a href='/'>返回</a></p>"
     session['player_name'] = player_name
+    session['game_id'] = uuid.uuid4().hex
+    session.pop('finalized', None)
     session['score'] = 0
     session['level'] = 1
     session['mistakes'] = 0
-    indices = list(range(len(quiz_data)))
-    random.shuffle(indices)
-    session['remaining_indices'] = indices
+    # 出題順序由種子決定，每關只前進游標
+    # 遊戲固定使用開始時的題庫版本，中途換題庫不影響已抽出的題號
+    bank = quiz_banks.current()
+    session['bank_version'] = bank.version
+    session['deck_seed'] = new_seed()
+    session['deck_size'] = len(bank)
+    session['deck_cursor'] = 0
     return redirect(url_for('setup_level'))
 
 @app.route("/setup_level")
@@ -114,12 +270,12 @@ def setup_level():
     mistakes = session['mistakes']
     if mistakes >= 3 or level > 10:
         return redirect(url_for('home'))
-    remaining = session.get('remaining_indices', [])
-    if len(remaining) < 3:
+    cursor = session.get('deck_cursor', 0)
+    current_questions = draw_questions(session['deck_seed'], session['deck_size'], cursor, 3)
+    if current_questions is None:
         return redirect(url_for('home'))
-    current_questions = remaining[:3]
     session['current_questions'] = current_questions
-    session['remaining_indices'] = remaining[3:]
+    session['deck_cursor'] = cursor + 3
     session['sub_q'] = 1
     session['level_user_answers'] = [None, None, None]
     return redirect(url_for('show_question'))
@@ -137,8 +293,12 @@ def show_question():
         return redirect(url_for('home'))
     if not (1 <= sub_q <= 3):
         return redirect(url_for('home'))
+    bank = game_bank()
+    if bank is None:
+        return redirect(url_for('home'))
     qidx = current_questions[sub_q - 1]
-    question_data = quiz_data[qidx]
+    # 選項順序由遊戲種子與題號算出，每位玩家、每一題各不相同
+    question_data = bank.question(qidx, choice_order(session['deck_seed'], qidx))
     time_limit = get_time_limit(level)
     return render_template("challenge.html",
                            level=level,
@@ -160,8 +320,11 @@ def submit_question():
     current_questions = session.get('current_questions', [])
     level_user_answers = session.get('level_user_answers', [])
     user_answer = request.form.get("answer", "")
+    bank = game_bank()
+    if bank is None:
+        return redirect(url_for('home'))
     qidx = current_questions[sub_q - 1]
-    correct_answer = quiz_data[qidx]["answer"]
+    correct_answer = bank[qidx]["answer"]
     if user_answer == correct_answer:
         score += 1
     else:
@@ -188,10 +351,13 @@ def show_level_result():
     total_score = session['score']
     current_questions = session.get('current_questions', [])
     level_user_answers = session.get('level_user_answers', [])
+    bank = game_bank()
+    if bank is None:
+        return redirect(url_for('home'))
     round_score = 0
     questions = []
     for i, qidx in enumerate(current_questions):
-        qdata = quiz_data[qidx]
+        qdata = bank[qidx]
         user_ans = level_user_answers[i]
         if user_ans == qdata["answer"]:
             round_score += 1
@@ -218,20 +384,19 @@ def finalize_game():
     if session.get("finalized"):
         print(f"玩家 {session['player_name']} 的成績已提交，跳過重複寫入")
         return
+    game_id = session.setdefault('game_id', uuid.uuid4().hex)
     now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    ws = open_worksheet()
-    existing_records = ws.get_all_records()
-    for record in existing_records:
-        if record.get("玩家") == session['player_name'] and record.get("完成時間") == now_str:
-            print(f"成績重複，已跳過寫入：{session['player_name']}, {now_str}")
-            session["finalized"] = True
-            return
-    ws.append_row([
-        session['player_name'],
-        session['score'],
-        session['level'],
-        now_str
-    ])
+    record = {
+        "name": session['player_name'],
+        "score": session['score'],
+        "level": session['level'],
+        "timestamp": now_str
+    }
+    result_spool.append(game_id, record)
+    if not leaderboard_store.append(game_id, record):
+        print(f"成績重複，已跳過寫入：{session['player_name']}, {game_id}")
+    elif not leaderboard_store.commits_async:
+        result_spool.ack(game_id)
     session["finalized"] = True
 
 @app.route("/time_up")
@@ -241,46 +406,114 @@ def time_up():
     session.clear()
     return render_template("time_up.html")
 
+RECORDS_PER_PAGE = 10
+# 瀏覽器每次都要重新驗證 (多半只拿到 304)，反向代理可共用 5 秒
+RANKING_CACHE_CONTROL = os.environ.get("RANKING_CACHE_CONTROL", "public, max-age=0, s-maxage=5")
+
+# 總排行、近 7 日、今日
+RANKING_WINDOWS = ("all", "week", "day")
+
 @app.route("/ranking")
 def ranking():
-    ws = open_worksheet()
-    all_data = ws.get_all_values()
-    if len(all_data) < 2:
-        records = []
-    else:
-        data_rows = all_data[1:]
-        records = []
-        for row in data_rows:
-            if len(row) < 4:
-                continue
-            name = row[0]
-            try:
-                score = int(row[1])
-            except:
-                score = 0
-            try:
-                level = int(row[2])
-            except:
-                level = 0
-            timestamp = row[3]
-            records.append({
-                "name": name,
-                "score": score,
-                "level": level,
-                "timestamp": timestamp
-            })
-    records.sort(key=lambda x: x["score"], reverse=True)
-    records_per_page = 10
     page = request.args.get("page", 1, type=int)
-    total_records = len(records)
-    total_pages = (total_records + records_per_page - 1) // records_per_page
-    start_idx = (page - 1) * records_per_page
-    end_idx = start_idx + records_per_page
-    current_page_records = records[start_idx:end_idx]
+    window = request.args.get("window", "all")
+    if window not in RANKING_WINDOWS:
+        window = "all"
+    try:
+        version = leaderboard_store.version()
+        stale = leaderboard_store.is_stale()
+        # 今日、近 7 日排行榜在換日時內容會變，日期也要納入 ETag 與頁面快取
+        today = datetime.now().strftime("%Y-%m-%d") if window != "all" else ""
+        etag = f"lb-{version}-{window}{today}-{page}-{int(stale)}"
+        if request.if_none_match.contains(etag):
+            return ranking_response(b"", etag, status=304)
+        body = ranking_page_cache.get(version, page, window, today, stale)
+        if body is None:
+            total_records = leaderboard_store.count(window)
+            current_page_records = leaderboard_store.top(page, RECORDS_PER_PAGE, window)
+            body = render_ranking_page(current_page_records, page, total_records, stale, window)
+            ranking_page_cache.put(version, page, body, window, today, stale)
+    except SHEETS_ERRORS as exc:
+        print(f"排行榜暫時無法讀取：{exc}")
+        return Response(render_ranking_page([], page, 0, True, window), mimetype="text/html")
+    return ranking_response(body, etag)
+
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+EXPORT_FLUSH_BYTES = 64 * 1024   # 緩衝超過此大小才送出一段
+
+@app.route("/ranking/export")
+def ranking_export():
+    """
+    串流匯出排行榜 (讀本機索引，不呼叫 Google Sheet)：
+    ?format=csv|ndjson&from=YYYY-MM-DD&to=YYYY-MM-DD&min_level=N
+    名次為篩選後的名次 (同分同名次)。
+    """
+    fmt = request.args.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        return Response("format 只能是 csv 或 ndjson", status=400, mimetype="text/plain")
+    try:
+        since = date.fromisoformat(request.args["from"]) if request.args.get("from") else None
+        until = date.fromisoformat(request.args["to"]) if request.args.get("to") else None
+    except ValueError:
+        return Response("日期格式應為 YYYY-MM-DD", status=400, mimetype="text/plain")
+    min_level = request.args.get("min_level", 0, type=int)
+    records = leaderboard_store.export(since, until, min_level)
+    body = export_csv(records) if fmt == "csv" else export_ndjson(records)
+    response = Response(body, mimetype=EXPORT_FORMATS[fmt])
+    response.headers["Content-Disposition"] = f"attachment; filename=leaderboard.{fmt}"
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+def ranked(records):
+    """加上名次 (同分同名次)"""
+    rank, last_score = 0, None
+    for position, record in enumerate(records, 1):
+        if record["score"] != last_score:
+            rank, last_score = position, record["score"]
+        yield rank, record
+
+def export_csv(records):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM 讓 Excel 正確辨識 UTF-8 中文
+    buffer.write("\ufeff")
+    writer.writerow(["名次", "玩家", "分數", "通關數", "完成時間"])
+    for rank, r in ranked(records):
+        writer.writerow([rank, r["name"], r["score"], r["level"], r["timestamp"]])
+        if buffer.tell() >= EXPORT_FLUSH_BYTES:
+            yield drain(buffer)
+    yield drain(buffer)
+
+def export_ndjson(records):
+    buffer = io.StringIO()
+    for rank, r in ranked(records):
+        row = {"rank": rank, "name": r["name"], "score": r["score"], "level": r["level"], "timestamp": r["timestamp"]}
+        buffer.write(json.dumps(row, ensure_ascii=False) + "\n")
+        if buffer.tell() >= EXPORT_FLUSH_BYTES:
+            yield drain(buffer)
+    yield drain(buffer)
+
+def drain(buffer):
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+def ranking_response(body, etag, status=200):
+    response = Response(body, status=status, mimetype="text/html")
+    # 只以 ETag 驗證：各 worker 看到新版本的時間不同，無法給出一致的 Last-Modified
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = RANKING_CACHE_CONTROL
+    return response
+
+def render_ranking_page(current_page_records, page, total_records, stale, window="all"):
+    total_pages = (total_records + RECORDS_PER_PAGE - 1) // RECORDS_PER_PAGE
     return render_template("ranking.html",
                            ranking=current_page_records,
                            page=page,
-                           total_pages=total_pages)
+                           total_pages=total_pages,
+                           stale=stale,
+                           window=window).encode("utf-8")
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
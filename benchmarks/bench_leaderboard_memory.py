@@ -0,0 +1,73 @@
+"""
+排行榜記憶體用量比較 (tracemalloc 量測建好後常駐的位元組數)：
+  dicts    ：原本 parse_leaderboard_rows 產生的 list of dict
+  bucket   ：ScoreBucketIndex (桶中存的仍是 dict)
+  columnar ：ColumnarLeaderboard (array 欄位 + 名稱表)
+
+用法：python benchmarks/bench_leaderboard_memory.py [筆數 ...]
+預設筆數：100000 1000000
+"""
+import os
+import sys
+import time
+import random
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from leaderboard_index import MAX_SCORE, ScoreBucketIndex, ColumnarLeaderboard
+
+DEFAULT_SIZES = [100_000, 1_000_000]
+PLAYERS_RATIO = 5   # 平均每位玩家玩幾場
+PAGES = [1, 2, 50]
+
+
+def make_records(n, seed=0):
+    """模擬從工作表讀入的紀錄：每個欄位都是新建立的物件"""
+    rng = random.Random(seed)
+    players = max(n // PLAYERS_RATIO, 1)
+    for _ in range(n):
+        yield {
+            "name": f"玩家{rng.randrange(players)}",
+            "score": rng.randint(0, MAX_SCORE),
+            "level": rng.randint(1, 10),
+            "timestamp": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} "
+                         f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}"
+        }
+
+
+def measure(build, n):
+    tracemalloc.start()
+    start = time.perf_counter()
+    structure = build(make_records(n))
+    build_s = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return structure, current, peak, build_s
+
+
+def page_ms(structure):
+    if isinstance(structure, list):
+        return float("nan")
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for p in PAGES:
+            structure.page(p, 10)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    print(f"{'rows':>10} {'impl':>9} {'MB':>9} {'B/row':>7} {'peak MB':>9} {'build s':>8} {'3 pages ms':>11}")
+    for n in sizes:
+        for name, build in (("dicts", list), ("bucket", ScoreBucketIndex), ("columnar", ColumnarLeaderboard)):
+            structure, current, peak, build_s = measure(build, n)
+            print(f"{n:>10} {name:>9} {current / 2**20:>9.1f} {current / n:>7.0f} "
+                  f"{peak / 2**20:>9.1f} {build_s:>8.2f} {page_ms(structure):>11.4f}")
+            del structure
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+題庫載入時間比較：
+  parse ：逐行以正規表示式解析 QA.txt (原本每次啟動的做法)
+  cold  ：第一次啟動，解析後寫入二進位快取
+  warm  ：之後啟動，大小與修改時間相符，直接讀快取
+  touch ：QA.txt 只被 touch 過，比對 SHA-256 後沿用快取並更新檔頭
+
+用法：python benchmarks/bench_question_bank.py [題數 ...]
+預設題數：100 10000 1000000
+"""
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from question_bank import load_quiz_bank
+
+DEFAULT_SIZES = [100, 10_000, 1_000_000]
+REPEAT = 3
+
+
+def write_bank(path, n):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(1, n + 1):
+            f.write(f"({i},'第 {i} 題：請問台北農產運銷公司拍賣的農產品為何？',"
+                    f"'蔬菜水果{i % 7}','雞鴨魚肉{i % 5}','花卉盆栽{i % 3}','作者{i % 50}'),\n")
+
+
+def timed(fn, repeat=REPEAT):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    print(f"{'questions':>10} {'file MB':>8} {'cache MB':>9} {'parse ms':>10} {'cold ms':>10} "
+          f"{'warm ms':>10} {'touch ms':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            qa_path = os.path.join(tmp, f"QA-{n}.txt")
+            cache_path = qa_path + ".bank"
+            write_bank(qa_path, n)
+            repeat = 1 if n >= 1_000_000 else REPEAT
+
+            def cold():
+                if os.path.exists(cache_path):
+                    os.remove(cache_path)
+                load_quiz_bank(qa_path, cache_path)
+
+            def touch():
+                os.utime(qa_path)
+                load_quiz_bank(qa_path, cache_path)
+
+            parse_ms = timed(lambda: load_quiz_bank(qa_path), repeat)
+            cold_ms = timed(cold, repeat)
+            warm_ms = timed(lambda: load_quiz_bank(qa_path, cache_path), repeat)
+            touch_ms = timed(touch, repeat)
+            print(f"{n:>10} {os.path.getsize(qa_path) / 2**20:>8.1f} {os.path.getsize(cache_path) / 2**20:>9.1f} "
+                  f"{parse_ms:>10.2f} {cold_ms:>10.2f} {warm_ms:>10.2f} {touch_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+排行榜排序效能比較：
+  sort   ：原本 ranking() 每次請求都做的 records.sort + 切片
+  sorted ：RankingIndex (排序索引)
+  bucket ：ScoreBucketIndex (分數計數排序)
+
+用法：python benchmarks/bench_ranking_index.py [筆數 ...]
+預設筆數：10000 100000 1000000 10000000
+"""
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from leaderboard_index import MAX_SCORE, RankingIndex, ScoreBucketIndex
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+PAGES = [1, 2, 50]
+REPEAT = 5
+
+
+def make_records(n, seed=0):
+    rng = random.Random(seed)
+    return [{
+        "name": f"p{i}",
+        "score": rng.randint(0, MAX_SCORE),
+        "level": rng.randint(1, 10),
+        "timestamp": f"2025-01-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00"
+    } for i in range(n)]
+
+
+def best_of(fn, repeat=REPEAT):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def bench_sort(records):
+    def request():
+        rows = list(records)
+        rows.sort(key=lambda x: x["score"], reverse=True)
+        for p in PAGES:
+            rows[(p - 1) * 10:p * 10]
+    return best_of(request, repeat=1 if len(records) >= 1_000_000 else REPEAT)
+
+
+def bench_index(factory, records):
+    start = time.perf_counter()
+    index = factory(records)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    def request():
+        for p in PAGES:
+            index.page(p, 10)
+    page_ms = best_of(request)
+    rank_ms = best_of(lambda: [index.rank_of(s) for s in range(MAX_SCORE + 1)])
+    extra = {"score": MAX_SCORE, "timestamp": "2025-01-28 23:59:59", "name": "x", "level": 10}
+    add_ms = best_of(lambda: index.add(dict(extra)), repeat=1)
+    return build_ms, page_ms, rank_ms / (MAX_SCORE + 1), add_ms
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    print(f"{'rows':>10} {'impl':>7} {'build ms':>10} {'3 pages ms':>11} {'rank_of ms':>11} {'add ms':>8}")
+    for n in sizes:
+        records = make_records(n)
+        print(f"{n:>10} {'sort':>7} {'-':>10} {bench_sort(records):>11.3f} {'-':>11} {'-':>8}")
+        for name, factory in (("sorted", RankingIndex), ("bucket", ScoreBucketIndex)):
+            build_ms, page_ms, rank_ms, add_ms = bench_index(factory, records)
+            print(f"{n:>10} {name:>7} {build_ms:>10.1f} {page_ms:>11.4f} {rank_ms:>11.5f} {add_ms:>8.4f}")
+        del records
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import re
+import json
+import time
+import random
+import threading
+from collections import deque
+import requests
+from gspread.exceptions import APIError
+
+# ---------------------------------------
+# 離線用的 Google Sheet 替身 (測試與壓力測試用)
+# ---------------------------------------
+DEFAULT_HEADER = ["玩家", "分數", "通關數", "完成時間"]
+RANGE_PATTERN = re.compile(r"^([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?$")
+
+
+def make_api_error(code, message):
+    """產生與 gspread 相同型別的 APIError，讓上層的錯誤處理一視同仁"""
+    response = requests.Response()
+    response.status_code = code
+    response._content = json.dumps({
+        "error": {"code": code, "message": message, "status": "FAKE"}
+    }).encode("utf-8")
+    return APIError(response)
+
+
+def column_index(letters):
+    index = 0
+    for ch in letters:
+        index = index * 26 + (ord(ch) - ord("A") + 1)
+    return index
+
+
+class FakeWorksheet:
+    """
+    記憶體中的工作表，實作 app 用到的 Worksheet 子集合：
+    get_all_values、get_all_records、get_values、append_row、append_rows。
+    可設定每次呼叫的延遲、錯誤率與每分鐘讀寫配額 (超過回傳 429)。
+    """
+
+    def __init__(self, rows=None, title="Leaderboard", latency=0.0, error_rate=0.0,
+                 read_quota=None, write_quota=None, seed=None):
+        self.title = title
+        self.latency = latency          # 每次呼叫的延遲秒數
+        self.error_rate = error_rate    # 0 ~ 1，隨機回傳 503 的機率
+        self.read_quota = read_quota    # 每分鐘讀取次數上限，None 表示不限制
+        self.write_quota = write_quota  # 每分鐘寫入次數上限，None 表示不限制
+        self._rows = [list(DEFAULT_HEADER)] if rows is None else [list(r) for r in rows]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._reads = deque()
+        self._writes = deque()
+        self.read_calls = 0
+        self.write_calls = 0
+
+    def _call(self, calls, quota, kind):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self.error_rate and self._random.random() < self.error_rate:
+                raise make_api_error(503, "The service is currently unavailable.")
+            if quota is not None:
+                now = time.monotonic()
+                while calls and now - calls[0] >= 60:
+                    calls.popleft()
+                if len(calls) >= quota:
+                    raise make_api_error(429, f"Quota exceeded for quota metric '{kind} requests' per minute.")
+                calls.append(now)
+
+    def _read(self):
+        self._call(self._reads, self.read_quota, "Read")
+        self.read_calls += 1
+
+    def _write(self):
+        self._call(self._writes, self.write_quota, "Write")
+        self.write_calls += 1
+
+    def get_all_values(self):
+        self._read()
+        with self._lock:
+            return [[str(v) for v in row] for row in self._rows]
+
+    def get_all_records(self):
+        values = self.get_all_values()
+        if not values:
+            return []
+        header = values[0]
+        records = []
+        for row in values[1:]:
+            row = row + [""] * (len(header) - len(row))
+            records.append({key: self._numericise(value) for key, value in zip(header, row)})
+        return records
+
+    @staticmethod
+    def _numericise(value):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+
+    def get_values(self, range_name=None):
+        """支援 "A5:D"、"A5:D9" 這類 A1 範圍"""
+        self._read()
+        with self._lock:
+            rows = [[str(v) for v in row] for row in self._rows]
+        if range_name is None:
+            return rows
+        match = RANGE_PATTERN.match(range_name.split("!")[-1])
+        if not match:
+            raise make_api_error(400, f"Unable to parse range: {range_name}")
+        first_col = column_index(match.group(1))
+        first_row = int(match.group(2) or 1)
+        last_col = column_index(match.group(3) or match.group(1))
+        last_row = int(match.group(4)) if match.group(4) else len(rows)
+        return [row[first_col - 1:last_col] for row in rows[first_row - 1:last_row]]
+
+    def get(self, range_name=None):
+        return self.get_values(range_name)
+
+    def append_row(self, values):
+        return self.append_rows([values])
+
+    def append_rows(self, values):
+        self._write()
+        with self._lock:
+            start = len(self._rows) + 1
+            self._rows.extend([str(v) for v in row] for row in values)
+            end = len(self._rows)
+        return {
+            "updates": {
+                "updatedRange": f"{self.title}!A{start}:D{end}",
+                "updatedRows": len(values)
+            }
+        }
+
+
+class FakeSheetsManager:
+    """與 SheetsClientManager 相同介面，永遠回傳同一個 FakeWorksheet"""
+
+    def __init__(self, worksheet):
+        self._worksheet = worksheet
+
+    @property
+    def cached_worksheet(self):
+        return self._worksheet
+
+    def worksheet(self):
+        return self._worksheet
+
+    def reset(self, keep_key=True):
+        pass
@@ -0,0 +1,341 @@
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from leaderboard_index import RankingIndex, WindowedLeaderboard
+
+
+def parse_leaderboard_rows(all_data):
+    """將工作表的所有列 (含標題列) 轉成排行榜紀錄"""
+    records = []
+    if len(all_data) < 2:
+        return records
+    for row in all_data[1:]:
+        record = parse_leaderboard_row(row)
+        if record is not None:
+            records.append(record)
+    return records
+
+
+def parse_leaderboard_row(row):
+    if len(row) < 4:
+        return None
+    try:
+        score = int(row[1])
+    except (TypeError, ValueError):
+        score = 0
+    try:
+        level = int(row[2])
+    except (TypeError, ValueError):
+        level = 0
+    return {
+        "name": row[0],
+        "score": score,
+        "level": level,
+        "timestamp": row[3]
+    }
+
+
+def normalize_row(row):
+    """工作表的一列補齊為 A:D 四欄字串，作為比對用的鍵"""
+    row = [str(v) for v in row[:4]]
+    return tuple(row + [""] * (4 - len(row)))
+
+
+def hash_rows(digest, rows):
+    """把各列 (正規化後) 依序加入 digest；一次或分批加入同樣的列，結果相同"""
+    for row in rows:
+        digest.update(("\x1f".join(normalize_row(row)) + "\n").encode("utf-8"))
+    return digest
+
+
+UPDATED_RANGE_PATTERN = re.compile(r"^[A-Z]+(\d+)(?::[A-Z]+(\d+))?$")
+
+
+def appended_row_numbers(response, count):
+    """
+    從 append_rows 的回應 (updates.updatedRange，例如 "Leaderboard!A5:D7")
+    取出新增各列的列號；格式不符時回傳 None
+    """
+    try:
+        updated_range = response["updates"]["updatedRange"]
+    except (KeyError, TypeError):
+        return None
+    match = UPDATED_RANGE_PATTERN.match(updated_range.rsplit("!", 1)[-1])
+    if not match:
+        return None
+    first = int(match.group(1))
+    last = int(match.group(2) or first)
+    if last - first + 1 != count:
+        return None
+    return list(range(first, last + 1))
+
+
+class SingleFlight:
+    """同一個 key 同時只執行一次 fn，其他同時呼叫者等待並共用同一個結果 (或例外)"""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _begin(self, key):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                return call, False
+            call = self._calls[key] = self._Call()
+            return call, True
+
+    def _run(self, key, call, fn):
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def do(self, key, fn):
+        call, leader = self._begin(key)
+        if leader:
+            self._run(key, call, fn)
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do_async(self, key, fn):
+        """在背景執行緒執行；已有同 key 的呼叫進行中則不再啟動，回傳是否啟動"""
+        call, leader = self._begin(key)
+        if leader:
+            threading.Thread(target=self._run, args=(key, call, fn), daemon=True).start()
+        return leader
+
+
+class LeaderboardCache:
+    """
+    排行榜的 TTL 快取：過期才向 Google Sheet 同步並更新排序索引，
+    新成績寫入時直接插入索引，換頁不需任何 Sheets 讀取或重新排序。
+
+    同步時只抓取上次看到的最後一列之後的範圍 (A{n}:D)；
+    若第 n 列內容已不同 (列被刪除或修改)，或距上次完整載入超過
+    full_reload_interval 秒，才重新下載整張工作表。
+
+    同一時間只會有一個同步請求 (single-flight)。已有舊資料時，
+    stale_while_revalidate 為 True 會先回傳舊資料，由背景執行緒同步。
+
+    另外維護今日、近 7 日排行榜 (WindowedLeaderboard)，與總排行一起更新。
+    """
+
+    def __init__(self, worksheet_getter, ttl, index_factory=RankingIndex, full_reload_interval=600,
+                 stale_while_revalidate=True):
+        self.worksheet_getter = worksheet_getter  # 回傳 Worksheet 的函式
+        self.ttl = ttl                            # 秒
+        self.index_factory = index_factory        # RankingIndex、ScoreBucketIndex 或 ColumnarLeaderboard
+        self.full_reload_interval = full_reload_interval
+        self.stale_while_revalidate = stale_while_revalidate
+        self._lock = threading.RLock()            # 保護索引與同步狀態，網路請求期間不持有
+        self._flight = SingleFlight()
+        self._index = None
+        self._windows = WindowedLeaderboard()
+        self._loaded_at = 0.0
+        self._full_loaded_at = 0.0
+        self._row_count = 0        # 已同步的列數 (含標題列)
+        self._last_row = None      # 第 _row_count 列的內容，用來偵測工作表被修改
+        self._pending = set()      # 已插入索引、但尚未在同步中看到的本機寫入 (工作表列號)
+        self._digest = hashlib.sha1()  # 已同步各列內容的雜湊，工作表中的列被修改時會改變
+        self._digest_hex = self._digest.hexdigest()[:12]
+        self.stale = False         # 最近一次同步失敗，目前提供的是舊資料
+
+    @property
+    def version(self):
+        """
+        索引內容的版本：已同步列數、尚未同步回來的本機寫入筆數與已同步內容的雜湊。
+        雜湊只取決於工作表內容 (不論分幾次同步)，同一張工作表在各 worker 同步到同一列時版本相同，
+        可用於 ETag；既有的列被就地修改後，完整重新載入時版本也會改變。
+        """
+        with self._lock:
+            return f"{self._row_count}.{len(self._pending)}.{self._digest_hex}"
+
+    def _expired(self):
+        return self._index is None or time.monotonic() - self._loaded_at >= self.ttl
+
+    def _full_reload(self, ws):
+        all_data = ws.get_all_values()
+        records = parse_leaderboard_rows(all_data)
+        index = self.index_factory(records)
+        windows = WindowedLeaderboard(records)
+        digest = hash_rows(hashlib.sha1(), all_data)
+        with self._lock:
+            self._index = index
+            self._windows = windows
+            self._digest = digest
+            self._digest_hex = digest.hexdigest()[:12]
+            self._row_count = len(all_data)
+            self._last_row = normalize_row(all_data[-1]) if all_data else None
+            self._pending.clear()
+            self._full_loaded_at = time.monotonic()
+
+    def _incremental_sync(self, ws):
+        """回傳 False 表示偵測到修改，需要完整重新載入"""
+        values = ws.get_values(f"A{self._row_count}:D")
+        if not values or normalize_row(values[0]) != self._last_row:
+            return False
+        with self._lock:
+            for row_number, row in enumerate(values[1:], self._row_count + 1):
+                if row_number in self._pending:
+                    self._pending.discard(row_number)
+                    continue
+                record = parse_leaderboard_row(row)
+                if record is not None:
+                    self._index.add(record)
+                    self._windows.add(record)
+            self._row_count += len(values) - 1
+            self._last_row = normalize_row(values[-1])
+            hash_rows(self._digest, values[1:])
+            self._digest_hex = self._digest.hexdigest()[:12]
+        return True
+
+    def _sync(self):
+        ws = self.worksheet_getter()
+        needs_full = (
+            self._index is None
+            or self._row_count == 0
+            or time.monotonic() - self._full_loaded_at >= self.full_reload_interval
+        )
+        if needs_full or not self._incremental_sync(ws):
+            self._full_reload(ws)
+
+    def _refresh(self):
+        try:
+            self._sync()
+        except Exception as exc:
+            if self._index is None:
+                raise
+            # 同步失敗 (配額用完、斷路器開啟等) 時繼續提供上次的資料
+            print(f"排行榜同步失敗，暫時使用舊資料：{exc}")
+            self.stale = True
+        else:
+            self.stale = False
+            self._loaded_at = time.monotonic()
+
+    def index(self):
+        with self._lock:
+            index = self._index
+            expired = self._expired()
+        if not expired:
+            return index
+        if index is not None and self.stale_while_revalidate:
+            self._flight.do_async("sync", self._refresh)
+            return index
+        self._flight.do("sync", self._refresh)
+        return self._index
+
+    # 讀取與新增都在鎖內進行，避免背景寫入器插入時索引被同時走訪
+    # window 為 "all" 時查總排行，其他值 ("day"、"week") 查時間區間排行榜
+    def page(self, page, per_page=10, window="all"):
+        index = self.index()
+        with self._lock:
+            if window != "all":
+                return self._windows.page(window, page, per_page)
+            return index.page(page, per_page)
+
+    def after(self, key, seen=0, limit=10):
+        """總排行中排序鍵 key 之後的 limit 筆 (見 RankingIndex.after)"""
+        index = self.index()
+        with self._lock:
+            return index.after(key, seen, limit)
+
+    def rank_of(self, score, window="all"):
+        index = self.index()
+        with self._lock:
+            if window != "all":
+                return self._windows.rank_of(window, score)
+            return index.rank_of(score)
+
+    def count(self, window="all"):
+        index = self.index()
+        with self._lock:
+            if window != "all":
+                return self._windows.count(window)
+            return len(index)
+
+    def records(self):
+        index = self.index()
+        with self._lock:
+            return list(index)
+
+    def add(self, record, row_number=None):
+        """
+        本機寫入成功後插入索引。以工作表列號對帳：同步已讀到該列就不再插入，
+        否則插入並記下列號，之後增量同步讀到該列時略過。列號不明時等下次同步再加入。
+        """
+        with self._lock:
+            if self._index is None or row_number is None:
+                return
+            if row_number <= self._row_count or row_number in self._pending:
+                return
+            self._index.add(record)
+            self._windows.add(record)
+            self._pending.add(row_number)
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+
+
+class PageRenderCache:
+    """
+    已渲染排行榜頁面的快取，key 為 (排行榜版本, 頁碼, ...)。
+    看到新版本時整批清除舊版本的頁面；超過 max_bytes 時依 LRU 淘汰，
+    但第 1 頁 (最常被瀏覽) 不會被淘汰。
+    """
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+        self._bytes = 0
+        self._version = None
+
+    def _switch_version(self, version):
+        if version != self._version:
+            self._pages.clear()
+            self._bytes = 0
+            self._version = version
+
+    def get(self, version, page, *variant):
+        with self._lock:
+            self._switch_version(version)
+            key = (page,) + variant
+            body = self._pages.get(key)
+            if body is not None:
+                self._pages.move_to_end(key)
+            return body
+
+    def put(self, version, page, body, *variant):
+        with self._lock:
+            self._switch_version(version)
+            if len(body) > self.max_bytes:
+                return
+            key = (page,) + variant
+            old = self._pages.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._pages[key] = body
+            self._bytes += len(body)
+            for victim in list(self._pages):
+                if self._bytes <= self.max_bytes:
+                    break
+                if victim[0] == 1:
+                    continue
+                self._bytes -= len(self._pages.pop(victim))
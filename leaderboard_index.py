@@ -0,0 +1,331 @@
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import date, datetime, timedelta
+from itertools import count
+from sortedcontainers import SortedKeyList
+
+MAX_SCORE = 30  # 10 關 × 每關 3 題
+WINDOW_DAYS = {"day": 1, "week": 7}  # 時間區間排行榜涵蓋的天數 (含今天)
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+EPOCH = datetime(1970, 1, 1)   # 完成時間以不含時區的 epoch 秒儲存，轉回字串時不受時區影響
+
+
+def ranking_key(record):
+    """排行榜排序鍵：分數高者在前，同分則先完成者在前"""
+    return (-record["score"], record["timestamp"])
+
+
+class RankingIndex:
+    """
+    依 (-分數, 完成時間) 排序的排行榜索引。
+    建立一次 O(n log n)，之後新增 O(log n)，取一頁 O(log n + 頁大小)。
+    """
+
+    def __init__(self, records=()):
+        # 第三個元素為流水號，讓完全相同的紀錄仍保持加入順序
+        self._seq = count()
+        self._items = SortedKeyList(
+            ((ranking_key(r) + (next(self._seq),), r) for r in records),
+            key=lambda item: item[0]
+        )
+
+    def add(self, record):
+        self._items.add((ranking_key(record) + (next(self._seq),), record))
+
+    def page(self, page, per_page=10):
+        if page < 1:
+            return []
+        start = (page - 1) * per_page
+        return [record for _, record in self._items.islice(start, start + per_page)]
+
+    def after(self, key, seen=0, limit=10):
+        """
+        排序鍵 key 之後的 limit 筆 (keyset 分頁)：排序鍵等於 key 的紀錄依加入順序排列，
+        略過其中前 seen 筆 (已讀過)，之後不論是否有新紀錄插入都不會重複或遺漏
+        """
+        start = self._items.bisect_key_left(tuple(key)) + seen
+        return [record for _, record in self._items.islice(start, start + limit)]
+
+    def rank_of(self, score):
+        """分數 score 的名次 (同分同名次)"""
+        return self._items.bisect_key_left((-score,)) + 1
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return (record for _, record in self._items)
+
+
+class ScoreBucketIndex:
+    """
+    利用分數範圍有限 (0 ~ MAX_SCORE) 的計數排序索引：
+    每個分數一個桶，桶內依完成時間排序，並維護「高於此分數的筆數」，
+    名次與百分位數 O(1)，取一頁 O(頁大小)。
+    """
+
+    def __init__(self, records=()):
+        self._buckets = [[] for _ in range(MAX_SCORE + 1)]
+        self._above = [0] * (MAX_SCORE + 1)   # _above[s]：分數高於 s 的筆數
+        self._total = 0
+        for record in records:
+            self._buckets[self._bucket_of(record["score"])].append(record)
+        for bucket in self._buckets:
+            bucket.sort(key=lambda r: r["timestamp"])
+        self._rebuild_counts()
+
+    @staticmethod
+    def _bucket_of(score):
+        return min(max(score, 0), MAX_SCORE)
+
+    def _rebuild_counts(self):
+        above = 0
+        for s in range(MAX_SCORE, -1, -1):
+            self._above[s] = above
+            above += len(self._buckets[s])
+        self._total = above
+
+    def add(self, record):
+        s = self._bucket_of(record["score"])
+        bucket = self._buckets[s]
+        if not bucket or bucket[-1]["timestamp"] <= record["timestamp"]:
+            bucket.append(record)
+        else:
+            insort(bucket, record, key=lambda r: r["timestamp"])
+        for t in range(s):
+            self._above[t] += 1
+        self._total += 1
+
+    def page(self, page, per_page=10):
+        if page < 1:
+            return []
+        return self._slice((page - 1) * per_page, per_page)
+
+    def _slice(self, start, limit):
+        """名次順序中第 start 筆起的 limit 筆"""
+        result = []
+        for s in range(MAX_SCORE, -1, -1):
+            if len(result) >= limit:
+                break
+            bucket = self._buckets[s]
+            if start >= self._above[s] + len(bucket):
+                continue
+            offset = max(start - self._above[s], 0)
+            result.extend(bucket[offset:offset + limit - len(result)])
+        return result
+
+    def after(self, key, seen=0, limit=10):
+        """排序鍵 key 之後的 limit 筆，略過同鍵的前 seen 筆 (見 RankingIndex.after)"""
+        s = self._bucket_of(-key[0])
+        offset = bisect_left(self._buckets[s], key[1], key=lambda r: r["timestamp"])
+        return self._slice(self._above[s] + offset + seen, limit)
+
+    def bucket(self, score):
+        """分數為 score 的紀錄 (依完成時間排序，唯讀)"""
+        return self._buckets[score]
+
+    def rank_of(self, score):
+        """分數 score 的名次 (同分同名次)"""
+        if score > MAX_SCORE:
+            return 1
+        if score < 0:
+            return self._total + 1
+        return self._above[score] + 1
+
+    def percentile(self, score):
+        """分數低於 score 的紀錄所佔百分比"""
+        if self._total == 0:
+            return 0.0
+        s = self._bucket_of(score)
+        below = self._total - self._above[s] - len(self._buckets[s])
+        return below * 100.0 / self._total
+
+    def __len__(self):
+        return self._total
+
+    def __iter__(self):
+        for s in range(MAX_SCORE, -1, -1):
+            yield from self._buckets[s]
+
+
+class ColumnarLeaderboard(ScoreBucketIndex):
+    """
+    欄式排行榜：每筆紀錄不再是一個 dict，而是分存於幾個陣列的同一列：
+    分數、通關數為 array('H')，完成時間為 epoch 秒 array('q')，
+    玩家名稱集中存一份於名稱表，列中只存名稱編號 array('I')。
+    沿用 ScoreBucketIndex 的分數桶與名次計算，只是桶內存的是依完成時間排序的列號，
+    page() 只為該頁的列建立 dict。
+    除了排行榜四個欄位，另以稀疏的選用欄位保存 game_id (有才存)，
+    JSON 日誌合併時能原樣寫回；Google Sheet 的紀錄沒有 game_id，不佔額外記憶體。
+    """
+
+    def __init__(self, records=()):
+        self._scores = array("H")
+        self._levels = array("H")
+        self._times = array("q")
+        self._name_ids = array("I")
+        self._names = []           # 編號 -> 玩家名稱
+        self._name_ids_by_name = {}
+        self._raw_times = {}       # 無法轉成 epoch 秒的完成時間：列號 -> 原字串
+        self._game_ids = {}        # 選用欄位：列號 -> game_id
+        rows_by_score = [[] for _ in range(MAX_SCORE + 1)]
+        for record in records:
+            rows_by_score[self._bucket_of(record["score"])].append(self._append_row(record))
+        self._buckets = [array("I", sorted(rows, key=self._times.__getitem__)) for rows in rows_by_score]
+        self._above = [0] * (MAX_SCORE + 1)
+        self._total = 0
+        self._rebuild_counts()
+
+    @staticmethod
+    def _epoch(timestamp):
+        """"YYYY-MM-DD HH:MM:SS" 轉 epoch 秒；其他格式回傳 None"""
+        if not isinstance(timestamp, str) or len(timestamp) != 19 or timestamp[10] != " ":
+            return None
+        try:
+            dt = datetime.fromisoformat(timestamp)
+        except ValueError:
+            return None
+        return (dt - EPOCH) // timedelta(seconds=1)
+
+    def _append_row(self, record):
+        row = len(self._scores)
+        name = str(record["name"])
+        name_id = self._name_ids_by_name.get(name)
+        if name_id is None:
+            name_id = self._name_ids_by_name[name] = len(self._names)
+            self._names.append(name)
+        seconds = self._epoch(record["timestamp"])
+        if seconds is None:
+            # 無法解析的 (例如空字串) 排在同分的最前面
+            self._raw_times[row] = str(record["timestamp"])
+            seconds = -1
+        game_id = record.get("game_id")
+        if game_id:
+            self._game_ids[row] = game_id
+        self._scores.append(min(max(int(record["score"]), 0), 0xFFFF))
+        self._levels.append(min(max(int(record["level"]), 0), 0xFFFF))
+        self._times.append(seconds)
+        self._name_ids.append(name_id)
+        return row
+
+    def row(self, row):
+        """把第 row 列組回 dict"""
+        timestamp = self._raw_times.get(row)
+        if timestamp is None:
+            timestamp = (EPOCH + timedelta(seconds=self._times[row])).strftime(TIMESTAMP_FORMAT)
+        record = {
+            "name": self._names[self._name_ids[row]],
+            "score": self._scores[row],
+            "level": self._levels[row],
+            "timestamp": timestamp
+        }
+        game_id = self._game_ids.get(row)
+        if game_id is not None:
+            record["game_id"] = game_id
+        return record
+
+    def add(self, record):
+        row = self._append_row(record)
+        s = self._bucket_of(record["score"])
+        bucket = self._buckets[s]
+        seconds = self._times[row]
+        if not bucket or self._times[bucket[-1]] <= seconds:
+            bucket.append(row)
+        else:
+            bucket.insert(bisect_right(bucket, seconds, key=self._times.__getitem__), row)
+        for t in range(s):
+            self._above[t] += 1
+        self._total += 1
+
+    def _slice(self, start, limit):
+        return [self.row(row) for row in super()._slice(start, limit)]
+
+    def after(self, key, seen=0, limit=10):
+        s = self._bucket_of(-key[0])
+        seconds = self._epoch(key[1])
+        offset = bisect_left(self._buckets[s], -1 if seconds is None else seconds, key=self._times.__getitem__)
+        return self._slice(self._above[s] + offset + seen, limit)
+
+    def bucket(self, score):
+        return [self.row(row) for row in self._buckets[score]]
+
+    def __iter__(self):
+        for s in range(MAX_SCORE, -1, -1):
+            for row in self._buckets[s]:
+                yield self.row(row)
+
+
+def record_day(record):
+    try:
+        return date.fromisoformat(str(record["timestamp"])[:10])
+    except ValueError:
+        return None
+
+
+class WindowedLeaderboard:
+    """
+    今日、近 7 日排行榜：依完成時間的日期分成每日一個 ScoreBucketIndex，
+    新成績只更新當天的索引，超過保留天數的日期整批丟棄。
+    查詢時依分數由高到低、同分依日期先後合併各日的桶，
+    取一頁為 O(天數 × 分數種類 + 頁大小)，與總筆數無關。
+    """
+
+    def __init__(self, records=(), retention_days=max(WINDOW_DAYS.values())):
+        self.retention_days = retention_days
+        self._days = {}   # date -> ScoreBucketIndex
+        today = date.today()
+        for record in records:
+            self.add(record, today)
+
+    def _cutoff(self, today):
+        return today - timedelta(days=self.retention_days - 1)
+
+    def add(self, record, today=None):
+        today = today or date.today()
+        day = record_day(record)
+        if day is None or day < self._cutoff(today):
+            return
+        index = self._days.get(day)
+        if index is None:
+            index = self._days[day] = ScoreBucketIndex()
+            self.expire(today)
+        index.add(record)
+
+    def expire(self, today=None):
+        cutoff = self._cutoff(today or date.today())
+        for day in [d for d in self._days if d < cutoff]:
+            del self._days[day]
+
+    def _indexes(self, window, today):
+        today = today or date.today()
+        first = today - timedelta(days=WINDOW_DAYS[window] - 1)
+        return [self._days[d] for d in sorted(self._days) if first <= d <= today]
+
+    def page(self, window, page, per_page=10, today=None):
+        if page < 1:
+            return []
+        indexes = self._indexes(window, today)
+        skip = (page - 1) * per_page
+        result = []
+        for s in range(MAX_SCORE, -1, -1):
+            for index in indexes:
+                bucket = index.bucket(s)
+                if skip >= len(bucket):
+                    skip -= len(bucket)
+                    continue
+                result.extend(bucket[skip:skip + per_page - len(result)])
+                skip = 0
+                if len(result) >= per_page:
+                    return result
+        return result
+
+    def rank_of(self, window, score, today=None):
+        return sum(index.rank_of(score) - 1 for index in self._indexes(window, today)) + 1
+
+    def count(self, window, today=None):
+        return sum(len(index) for index in self._indexes(window, today))
+
+    def __iter__(self):
+        """依日期保留的所有紀錄 (不排序)"""
+        for index in self._days.values():
+            yield from index
@@ -0,0 +1,300 @@
+import os
+import mmap
+import time
+import fcntl
+import struct
+import threading
+from leaderboard_store import WINDOW_ALL, EXPORT_CHUNK, LeaderboardStore
+
+# ---------------------------------------
+# 多個 worker 共用的排行榜快照 (記憶體映射檔)
+#
+# 檔頭 64 bytes：magic、格式版本、旗標、版本序號、筆數、容量、發布時間
+# 之後為固定寬度的紀錄，已依名次排序：
+#   玩家 (UTF-8，32 bytes)、分數 (uint16)、通關數 (uint16)、完成時間 (20 bytes)
+#
+# 版本序號採 seqlock：發布者寫入前改為奇數、寫完改為下一個偶數；
+# 讀者前後讀到相同的偶數序號才採用，全程不需加鎖。
+# ---------------------------------------
+MAGIC = b"DVLB"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHHQIId")
+HEADER_SIZE = 64
+RECORD = struct.Struct("<32sHH20s")
+SEQ_OFFSET = 8
+FLAG_SUPERSEDED = 1   # 檔案已被更大的新檔取代，讀者需重新映射
+
+
+def encode_text(text, size):
+    data = str(text).encode("utf-8")[:size]
+    # 截斷時不留下不完整的多位元組字元
+    return data.decode("utf-8", "ignore").encode("utf-8")
+
+
+def decode_text(data):
+    return data.rstrip(b"\0").decode("utf-8", "ignore")
+
+
+def clamp_u16(value):
+    return min(max(int(value), 0), 0xFFFF)
+
+
+class SnapshotPublisher:
+    """把排好序的紀錄寫入快照檔 (只應由一個程序執行)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._mm = None
+        self._capacity = 0
+        self._seq = 0
+
+    def _open_existing(self):
+        try:
+            f = open(self.path, "r+b")
+        except FileNotFoundError:
+            return False
+        size = os.fstat(f.fileno()).st_size
+        if size < HEADER_SIZE:
+            f.close()
+            return False
+        mm = mmap.mmap(f.fileno(), size)
+        magic, fmt, flags, seq, count, capacity, _ = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or fmt != FORMAT_VERSION or flags & FLAG_SUPERSEDED \
+                or size < HEADER_SIZE + capacity * RECORD.size:
+            mm.close()
+            f.close()
+            return False
+        self._file, self._mm, self._capacity = f, mm, capacity
+        self._seq = seq + (seq & 1)
+        return True
+
+    def _create(self, capacity):
+        """建立新檔並以 os.replace 換上，舊檔標記為已取代"""
+        size = HEADER_SIZE + capacity * RECORD.size
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.truncate(size)
+        f = open(tmp_path, "r+b")
+        mm = mmap.mmap(f.fileno(), size)
+        # 序號先設為奇數，讀者在第一次發布完成前不會採用
+        HEADER.pack_into(mm, 0, MAGIC, FORMAT_VERSION, 0, self._seq + 1, 0, capacity, time.time())
+        os.replace(tmp_path, self.path)
+        if self._mm is not None:
+            HEADER.pack_into(self._mm, 0, MAGIC, FORMAT_VERSION, FLAG_SUPERSEDED,
+                             self._seq, 0, self._capacity, time.time())
+            self._mm.close()
+            self._file.close()
+        self._file, self._mm, self._capacity = f, mm, capacity
+
+    def publish(self, records):
+        records = list(records)
+        if self._mm is None and not self._open_existing():
+            self._create(max(1024, len(records) * 2))
+        elif len(records) > self._capacity:
+            self._create(len(records) * 2)
+        mm = self._mm
+        struct.pack_into("<Q", mm, SEQ_OFFSET, self._seq + 1)
+        offset = HEADER_SIZE
+        for r in records:
+            RECORD.pack_into(mm, offset,
+                             encode_text(r["name"], 32),
+                             clamp_u16(r["score"]),
+                             clamp_u16(r["level"]),
+                             encode_text(r["timestamp"], 20))
+            offset += RECORD.size
+        HEADER.pack_into(mm, 0, MAGIC, FORMAT_VERSION, 0, self._seq + 1,
+                         len(records), self._capacity, time.time())
+        self._seq += 2
+        struct.pack_into("<Q", mm, SEQ_OFFSET, self._seq)
+        return self._seq
+
+
+class SnapshotReader:
+    """
+    以 mmap 讀取快照，只解出需要的那一頁。
+    多個執行緒共用同一個映射：重新映射時只換掉 _mm，不主動關閉舊的映射，
+    仍在讀舊映射的執行緒持有自己的參照，用完後由垃圾回收關閉。
+    """
+
+    def __init__(self, path, max_retries=100):
+        self.path = path
+        self.max_retries = max_retries
+        self._lock = threading.Lock()   # 只保護重新映射，讀取不需加鎖
+        self._mm = None
+
+    def _map(self, stale=None):
+        """重新映射並回傳新的映射；stale 已被其他執行緒換掉時直接沿用目前的映射"""
+        with self._lock:
+            if self._mm is not stale:
+                return self._mm
+            try:
+                with open(self.path, "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size >= HEADER_SIZE else None
+            except FileNotFoundError:
+                mm = None
+            self._mm = mm
+            return mm
+
+    def _consistent(self, fn):
+        """seqlock 讀取：序號為偶數且前後一致時才回傳 fn 的結果；沒有快照時回傳 None"""
+        for _ in range(self.max_retries):
+            mm = self._mm
+            if mm is None:
+                mm = self._map(None)
+                if mm is None:
+                    return None
+            magic, fmt, flags, seq, count, capacity, _ = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or fmt != FORMAT_VERSION:
+                return None
+            if flags & FLAG_SUPERSEDED:
+                self._map(mm)
+                continue
+            if seq & 1 or seq == 0:
+                time.sleep(0)
+                continue
+            result = fn(mm, count)
+            if struct.unpack_from("<Q", mm, SEQ_OFFSET)[0] == seq:
+                return seq, result
+        return None
+
+    @staticmethod
+    def _record_at(mm, i):
+        name, score, level, timestamp = RECORD.unpack_from(mm, HEADER_SIZE + i * RECORD.size)
+        return {"name": decode_text(name), "score": score, "level": level,
+                "timestamp": decode_text(timestamp)}
+
+    def page(self, page, per_page=10):
+        if page < 1:
+            return []
+        start = (page - 1) * per_page
+
+        def read(mm, count):
+            return [self._record_at(mm, i) for i in range(start, min(start + per_page, count))]
+        result = self._consistent(read)
+        return None if result is None else result[1]
+
+    def after(self, key, seen=0, limit=10):
+        """排序鍵 key 之後的 limit 筆，略過同鍵的前 seen 筆 (見 RankingIndex.after)"""
+        def read(mm, count):
+            # 紀錄依 (-分數, 完成時間) 排序，二分搜尋第一個排序鍵 >= key 的位置
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                _, score, _, timestamp = RECORD.unpack_from(mm, HEADER_SIZE + mid * RECORD.size)
+                if (-score, decode_text(timestamp)) < key:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            start = lo + seen
+            return [self._record_at(mm, i) for i in range(start, min(start + limit, count))]
+        result = self._consistent(read)
+        return None if result is None else result[1]
+
+    def rank_of(self, score):
+        def read(mm, count):
+            # 紀錄依分數遞減排序，二分搜尋第一個分數 <= score 的位置
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if RECORD.unpack_from(mm, HEADER_SIZE + mid * RECORD.size)[1] > score:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return lo + 1
+        result = self._consistent(read)
+        return None if result is None else result[1]
+
+    def count(self):
+        result = self._consistent(lambda mm, count: count)
+        return None if result is None else result[1]
+
+    def version(self):
+        result = self._consistent(lambda mm, count: None)
+        return None if result is None else result[0]
+
+
+
+class SnapshotLeaderboardStore(LeaderboardStore):
+    """
+    包住另一個排行榜後端：寫入交給原本的後端，讀取走共用的 mmap 快照。
+    各 worker 以 fcntl 非阻塞鎖競選，只有取得鎖的程序負責定期從後端重新整理並發布快照；
+    該程序結束後鎖自動釋放，由其他 worker 接手。
+    快照只包含總排行；今日、近 7 日排行榜直接查詢原本的後端。
+    """
+
+    def __init__(self, inner, path, interval=2.0):
+        self.inner = inner
+        self.path = path
+        self.interval = interval
+        self.commits_async = inner.commits_async
+        self.reader = SnapshotReader(path)
+        self._publisher = None
+        self._published_version = None
+        self._wakeup = threading.Event()
+        self._lock_fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        self._thread = threading.Thread(target=self._run, name="leaderboard-snapshot", daemon=True)
+        self._thread.start()
+
+    def _try_lead(self):
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        self._publisher = SnapshotPublisher(self.path)
+        print(f"程序 {os.getpid()} 負責發布排行榜快照")
+        return True
+
+    def refresh(self):
+        """後端版本有變動時重新發布快照 (只有領頭程序會執行)"""
+        version = self.inner.version()
+        if version != self._published_version:
+            self._publisher.publish(self.inner)
+            self._published_version = version
+
+    def _run(self):
+        while True:
+            if self._publisher is not None or self._try_lead():
+                try:
+                    self.refresh()
+                except Exception as exc:
+                    print(f"發布排行榜快照失敗：{exc}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def append(self, game_id, record):
+        appended = self.inner.append(game_id, record)
+        if appended and self._publisher is not None:
+            self._wakeup.set()
+        return appended
+
+    def replay(self, game_id, record):
+        self.inner.replay(game_id, record)
+
+    def top(self, page, per_page=10, window=WINDOW_ALL):
+        rows = self.reader.page(page, per_page) if window == WINDOW_ALL else None
+        return self.inner.top(page, per_page, window) if rows is None else rows
+
+    def top_after(self, key, seen=0, limit=EXPORT_CHUNK):
+        rows = self.reader.after(tuple(key), seen, limit)
+        return self.inner.top_after(key, seen, limit) if rows is None else rows
+
+    def rank_of(self, score, window=WINDOW_ALL):
+        rank = self.reader.rank_of(score) if window == WINDOW_ALL else None
+        return self.inner.rank_of(score, window) if rank is None else rank
+
+    def count(self, window=WINDOW_ALL):
+        total = self.reader.count() if window == WINDOW_ALL else None
+        return self.inner.count(window) if total is None else total
+
+    def version(self):
+        # 快照序號與後端版本是不相關的計數，加上前綴避免在 ETag 與頁面快取中撞在一起
+        version = self.reader.version()
+        return f"i{self.inner.version()}" if version is None else f"s{version}"
+
+    def __iter__(self):
+        return self.export()
+
+    def is_stale(self):
+        return self.inner.is_stale()
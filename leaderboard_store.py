@@ -0,0 +1,506 @@
+import os
+import json
+import fcntl
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, timedelta
+from leaderboard_index import RankingIndex, WindowedLeaderboard, ranking_key
+
+WINDOW_ALL = "all"   # 總排行；其他區間見 leaderboard_index.WINDOW_DAYS
+EXPORT_CHUNK = 1000  # 匯出時每批讀取的筆數
+
+
+class LeaderboardStore:
+    """
+    排行榜儲存介面。紀錄格式：
+    {"name": 玩家, "score": 分數, "level": 通關數, "timestamp": 完成時間}
+
+    commits_async 為 True 時，append() 返回後成績仍在背景寫入中，
+    完成後由 LeaderboardWriter 的 on_committed 通知。
+
+    top / rank_of / count 的 window 可為 "all" (總排行)、"week" (近 7 日)、"day" (今日)。
+    """
+
+    commits_async = False
+
+    def append(self, game_id, record):
+        """新增一筆成績；game_id 已存在則不寫入並回傳 False"""
+        raise NotImplementedError
+
+    def replay(self, game_id, record):
+        """重播暫存檔中未確認的成績；必須可重複執行"""
+        raise NotImplementedError
+
+    def top(self, page, per_page=10, window=WINDOW_ALL):
+        """依分數由高到低取得第 page 頁 (從 1 開始)"""
+        raise NotImplementedError
+
+    def top_after(self, key, seen=0, limit=EXPORT_CHUNK):
+        """
+        總排行中排序鍵 key (-分數, 完成時間) 之後的 limit 筆。
+        同鍵的紀錄依加入順序排列，略過其中前 seen 筆；(key, seen) 即可唯一定位已讀到的位置
+        """
+        raise NotImplementedError
+
+    def rank_of(self, score, window=WINDOW_ALL):
+        """分數 score 的名次 (同分同名次)"""
+        raise NotImplementedError
+
+    def count(self, window=WINDOW_ALL):
+        raise NotImplementedError
+
+    def version(self):
+        """
+        排行榜內容的版本，內容有變動時一定會改變；
+        多個 worker 看到相同內容時應回傳相同的值 (用於 ETag)。
+        """
+        raise NotImplementedError
+
+    def __iter__(self):
+        """依名次順序走訪所有紀錄"""
+        raise NotImplementedError
+
+    def export(self, since=None, until=None, min_level=0):
+        """
+        依名次順序逐批產生符合條件的紀錄，since / until 為 date (含當天)。
+        每次只取 EXPORT_CHUNK 筆，記憶體用量與總筆數無關；
+        以 (最後一筆的排序鍵, 同鍵已輸出筆數) 為游標向後分頁 (top_after)，
+        批次之間有新成績插入也不會重複或遺漏。
+        """
+        key, seen = None, 0
+        while True:
+            rows = self.top(1, EXPORT_CHUNK) if key is None else self.top_after(key, seen, EXPORT_CHUNK)
+            for record in rows:
+                record_key = ranking_key(record)
+                if record_key == key:
+                    seen += 1
+                else:
+                    key, seen = record_key, 1
+                if record_matches(record, since, until, min_level):
+                    yield record
+            if len(rows) < EXPORT_CHUNK:
+                return
+
+    def is_stale(self):
+        """資料是否可能延遲 (例如 Google Sheet 暫時無法讀取)"""
+        return False
+
+
+def row_to_record(row):
+    return {"name": row[0], "score": row[1], "level": row[2], "timestamp": row[3]}
+
+
+def record_to_row(record):
+    return [record["name"], record["score"], record["level"], record["timestamp"]]
+
+
+def record_matches(record, since=None, until=None, min_level=0):
+    """完成日期在 since ~ until 之間 (含)，且通關數至少 min_level"""
+    if record["level"] < min_level:
+        return False
+    day = str(record["timestamp"])[:10]
+    if since is not None and day < since.isoformat():
+        return False
+    if until is not None and day > until.isoformat():
+        return False
+    return True
+
+
+class SheetsLeaderboardStore(LeaderboardStore):
+    """以 Google Sheet 為主要儲存：讀取走 TTL 快取，寫入走背景佇列"""
+
+    commits_async = True
+
+    def __init__(self, cache, writer, committed_games):
+        self.cache = cache
+        self.writer = writer
+        self.committed_games = committed_games
+
+    def append(self, game_id, record):
+        if not self.committed_games.claim(game_id):
+            return False
+        self.writer.submit(game_id, record_to_row(record))
+        return True
+
+    def replay(self, game_id, record):
+        # 仍在本程序的佇列或重試中，寫入完成後會自行確認
+        if game_id in self.writer:
+            return
+        # 中止前可能已登記但尚未寫入，因此不論是否登記過都重新送出
+        self.committed_games.claim(game_id)
+        self.writer.submit(game_id, record_to_row(record))
+
+    def top(self, page, per_page=10, window=WINDOW_ALL):
+        return self.cache.page(page, per_page, window)
+
+    def top_after(self, key, seen=0, limit=EXPORT_CHUNK):
+        return self.cache.after(key, seen, limit)
+
+    def rank_of(self, score, window=WINDOW_ALL):
+        return self.cache.rank_of(score, window)
+
+    def count(self, window=WINDOW_ALL):
+        return self.cache.count(window)
+
+    def version(self):
+        self.cache.index()   # 過期時先同步
+        return self.cache.version
+
+    def __iter__(self):
+        return iter(self.cache.records())
+
+    def is_stale(self):
+        return self.cache.stale
+
+
+class SQLiteLeaderboardStore(LeaderboardStore):
+    """
+    以本機 SQLite (WAL) 為主要儲存，分數與完成時間皆有索引；
+    mirror 若有提供 (LeaderboardWriter)，成績會再非同步寫入 Google Sheet 備份。
+    """
+
+    def __init__(self, db_path, mirror=None):
+        self.db_path = db_path
+        self.mirror = mirror
+        self.commits_async = mirror is not None
+        self._lock = threading.Lock()
+        self._windows = None        # 今日、近 7 日排行榜 (記憶體索引)
+        self._windows_last_id = 0   # 已加入 _windows 的最大 id
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leaderboard ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " game_id TEXT UNIQUE,"
+            " name TEXT NOT NULL,"
+            " score INTEGER NOT NULL,"
+            " level INTEGER NOT NULL,"
+            " timestamp TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_leaderboard_score"
+            " ON leaderboard (score DESC, timestamp, id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_leaderboard_timestamp ON leaderboard (timestamp)"
+        )
+        # 一次性作業的完成標記 (例如已從 Google Sheet 匯入)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def append(self, game_id, record):
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO leaderboard (game_id, name, score, level, timestamp)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (game_id, record["name"], record["score"], record["level"], record["timestamp"])
+            )
+        if cur.rowcount != 1:
+            return False
+        if self.mirror is not None:
+            self.mirror.submit(game_id, record_to_row(record))
+        return True
+
+    def replay(self, game_id, record):
+        # 本機已有此成績時仍補送備份，確保 Google Sheet 也收到 (備份仍在佇列或重試中則不必)
+        if not self.append(game_id, record) and self.mirror is not None and game_id not in self.mirror:
+            self.mirror.submit(game_id, record_to_row(record))
+
+    def needs_import(self):
+        """尚未從 Google Sheet 匯入過既有紀錄"""
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM meta WHERE key = 'imported'").fetchone()
+        return row is None
+
+    def import_records(self, records):
+        """
+        匯入沒有遊戲 ID 的既有紀錄 (例如從 Google Sheet 初次載入)，只會成功執行一次。
+        多個 worker 同時呼叫時以 BEGIN IMMEDIATE 排隊，後到者看到完成標記就不再匯入；
+        內容與資料表中已有紀錄相同的列 (例如匯入期間已備份到 Sheet 的新成績) 會略過。
+        回傳實際匯入的筆數。
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self._conn.execute("SELECT 1 FROM meta WHERE key = 'imported'").fetchone():
+                    self._conn.execute("ROLLBACK")
+                    return 0
+                existing = Counter(self._conn.execute(
+                    "SELECT name, score, level, timestamp FROM leaderboard"
+                ))
+                rows = []
+                for r in records:
+                    key = (r["name"], r["score"], r["level"], r["timestamp"])
+                    if existing[key] > 0:
+                        existing[key] -= 1
+                        continue
+                    rows.append(key)
+                self._conn.executemany(
+                    "INSERT INTO leaderboard (name, score, level, timestamp) VALUES (?, ?, ?, ?)", rows
+                )
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('imported', ?)", (str(len(rows)),))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    def _window_index(self):
+        """以 id 遞增補上其他 worker 新增的紀錄，只讀取保留天數內的資料 (呼叫前需持有 _lock)"""
+        columns = "SELECT id, name, score, level, timestamp FROM leaderboard"
+        if self._windows is None:
+            self._windows = WindowedLeaderboard()
+            cutoff = date.today() - timedelta(days=self._windows.retention_days - 1)
+            (self._windows_last_id,) = self._conn.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM leaderboard").fetchone()
+            # 完成時間為 "YYYY-MM-DD HH:MM:SS"，字串比較即時間先後，可走 timestamp 索引
+            rows = self._conn.execute(columns + " WHERE timestamp >= ? AND id <= ? ORDER BY id",
+                                      (cutoff.isoformat(), self._windows_last_id)).fetchall()
+        else:
+            rows = self._conn.execute(columns + " WHERE id > ? ORDER BY id",
+                                      (self._windows_last_id,)).fetchall()
+        for row_id, name, score, level, timestamp in rows:
+            self._windows.add({"name": name, "score": score, "level": level, "timestamp": timestamp})
+            self._windows_last_id = max(self._windows_last_id, row_id)
+        self._windows.expire()
+        return self._windows
+
+    def top(self, page, per_page=10, window=WINDOW_ALL):
+        if page < 1:
+            return []
+        with self._lock:
+            if window != WINDOW_ALL:
+                return self._window_index().page(window, page, per_page)
+            rows = self._conn.execute(
+                "SELECT name, score, level, timestamp FROM leaderboard"
+                " ORDER BY score DESC, timestamp, id LIMIT ? OFFSET ?",
+                (per_page, (page - 1) * per_page)
+            ).fetchall()
+        return [
+            {"name": name, "score": score, "level": level, "timestamp": timestamp}
+            for name, score, level, timestamp in rows
+        ]
+
+    def top_after(self, key, seen=0, limit=EXPORT_CHUNK):
+        score, timestamp = -key[0], key[1]
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, score, level, timestamp FROM leaderboard"
+                " WHERE score < ? OR (score = ? AND timestamp >= ?)"
+                " ORDER BY score DESC, timestamp, id LIMIT ? OFFSET ?",
+                (score, score, timestamp, limit, seen)
+            ).fetchall()
+        return [
+            {"name": name, "score": score, "level": level, "timestamp": timestamp}
+            for name, score, level, timestamp in rows
+        ]
+
+    def rank_of(self, score, window=WINDOW_ALL):
+        with self._lock:
+            if window != WINDOW_ALL:
+                return self._window_index().rank_of(window, score)
+            (higher,) = self._conn.execute(
+                "SELECT COUNT(*) FROM leaderboard WHERE score > ?", (score,)
+            ).fetchone()
+        return higher + 1
+
+    def count(self, window=WINDOW_ALL):
+        with self._lock:
+            if window != WINDOW_ALL:
+                return self._window_index().count(window)
+            (total,) = self._conn.execute("SELECT COUNT(*) FROM leaderboard").fetchone()
+        return total
+
+    def version(self):
+        # 只會新增不會修改，最大 id 即可代表版本
+        with self._lock:
+            (max_id,) = self._conn.execute("SELECT MAX(id) FROM leaderboard").fetchone()
+        return max_id or 0
+
+    def __iter__(self):
+        return self.export()
+
+    def export(self, since=None, until=None, min_level=0):
+        # 另開唯讀連線逐列讀取 (WAL 允許同時讀寫)，條件交給 SQLite，不必一次載入全部紀錄
+        conditions, params = [], []
+        if min_level > 0:
+            conditions.append("level >= ?")
+            params.append(min_level)
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            params.append(since.isoformat())
+        if until is not None:
+            conditions.append("timestamp < ?")
+            params.append((until + timedelta(days=1)).isoformat())
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for name, score, level, timestamp in conn.execute(
+                "SELECT name, score, level, timestamp FROM leaderboard" + where +
+                " ORDER BY score DESC, timestamp, id", params
+            ):
+                yield {"name": name, "score": score, "level": level, "timestamp": timestamp}
+        finally:
+            conn.close()
+
+
+class JsonJournalLeaderboardStore(LeaderboardStore):
+    """
+    舊版 leaderboard.json 的儲存方式改為：
+    - 每筆新成績只附加一行到 <path>.journal (JSON Lines)，寫入成本 O(1)
+    - 日誌累積 compact_every 筆後，由背景執行緒合併成依分數排序的 leaderboard.json
+      (先寫暫存檔再 os.replace，檔案永遠是完整可讀的 JSON)，玩家的請求不必等待合併
+    - 以 fcntl 檔案鎖協調多個 worker：附加與讀取取共享鎖，合併取獨佔鎖
+    """
+
+    def __init__(self, path, compact_every=1000, index_factory=RankingIndex):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.compact_every = compact_every
+        self.index_factory = index_factory
+        self._lock = threading.RLock()
+        self._lock_fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        self._journal_fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._snapshot_id = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._index = None
+        self._windows = None   # 今日、近 7 日排行榜
+        self._game_ids = set()
+        self._compact_wanted = threading.Event()
+        with self._flock(fcntl.LOCK_SH):
+            self._refresh()
+        self._compactor = threading.Thread(target=self._run_compactor, name="leaderboard-compactor", daemon=True)
+        self._compactor.start()
+        if self._journal_entries >= self.compact_every:
+            self._compact_wanted.set()
+
+    @contextmanager
+    def _flock(self, operation):
+        fcntl.flock(self._lock_fd, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _stat_snapshot(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _load_snapshot(self, snapshot_id):
+        records = []
+        if snapshot_id is not None:
+            with open(self.path, "r", encoding="utf-8") as f:
+                records = json.load(f)
+        self._index = self.index_factory(records)
+        self._windows = WindowedLeaderboard(records)
+        self._game_ids = {r["game_id"] for r in records if r.get("game_id")}
+        self._snapshot_id = snapshot_id
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+    def _refresh(self):
+        """讀入其他 worker 合併後的新快照，以及日誌中尚未讀過的部分"""
+        snapshot_id = self._stat_snapshot()
+        journal_size = os.fstat(self._journal_fd).st_size
+        if self._index is None or snapshot_id != self._snapshot_id or journal_size < self._journal_offset:
+            self._load_snapshot(snapshot_id)
+        if journal_size == self._journal_offset:
+            return
+        with open(self.journal_path, "rb") as f:
+            f.seek(self._journal_offset)
+            data = f.read(journal_size - self._journal_offset)
+        end = data.rfind(b"\n") + 1   # 只處理完整的行
+        for line in data[:end].splitlines():
+            record = json.loads(line)
+            game_id = record.get("game_id")
+            if game_id and game_id in self._game_ids:
+                continue
+            if game_id:
+                self._game_ids.add(game_id)
+            self._index.add(record)
+            self._windows.add(record)
+            self._journal_entries += 1
+        self._journal_offset += end
+
+    def append(self, game_id, record):
+        with self._lock:
+            with self._flock(fcntl.LOCK_SH):
+                self._refresh()
+                if game_id in self._game_ids:
+                    return False
+                line = json.dumps(dict(record, game_id=game_id), ensure_ascii=False) + "\n"
+                os.write(self._journal_fd, line.encode("utf-8"))
+                self._refresh()
+            if self._journal_entries >= self.compact_every:
+                self._compact_wanted.set()
+        return True
+
+    def replay(self, game_id, record):
+        self.append(game_id, record)
+
+    def _run_compactor(self):
+        while True:
+            self._compact_wanted.wait()
+            self._compact_wanted.clear()
+            try:
+                self.compact()
+            except Exception as exc:
+                # 日誌仍完整保留，下次累積到門檻時再合併
+                print(f"合併排行榜日誌失敗：{exc}")
+
+    def compact(self):
+        """把日誌合併進排序後的 leaderboard.json，並清空日誌"""
+        with self._lock, self._flock(fcntl.LOCK_EX):
+            self._refresh()
+            if self._journal_entries == 0:
+                return
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(list(self._index), f, ensure_ascii=False, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            os.ftruncate(self._journal_fd, 0)
+            self._snapshot_id = self._stat_snapshot()
+            self._journal_offset = 0
+            self._journal_entries = 0
+
+    def _read(self, fn):
+        with self._lock:
+            with self._flock(fcntl.LOCK_SH):
+                self._refresh()
+            return fn(self._index)
+
+    def top(self, page, per_page=10, window=WINDOW_ALL):
+        if window != WINDOW_ALL:
+            return self._read(lambda index: self._windows.page(window, page, per_page))
+        return self._read(lambda index: index.page(page, per_page))
+
+    def top_after(self, key, seen=0, limit=EXPORT_CHUNK):
+        return self._read(lambda index: index.after(key, seen, limit))
+
+    def rank_of(self, score, window=WINDOW_ALL):
+        if window != WINDOW_ALL:
+            return self._read(lambda index: self._windows.rank_of(window, score))
+        return self._read(lambda index: index.rank_of(score))
+
+    def count(self, window=WINDOW_ALL):
+        if window != WINDOW_ALL:
+            return self._read(lambda index: self._windows.count(window))
+        return self._read(len)
+
+    def version(self):
+        # 快照檔 (inode、修改時間) 加上已讀到的日誌位置，各 worker 讀到相同位置時版本相同
+        def current(index):
+            snapshot_id = self._snapshot_id or (0, 0, 0)
+            return f"{snapshot_id[0]}.{snapshot_id[1]}.{self._journal_offset}"
+        return self._read(current)
+
+    def __iter__(self):
+        return iter(self._read(list))
@@ -0,0 +1,359 @@
+import os
+import json
+import time
+import fcntl
+import queue
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+
+class CommittedGameIndex:
+    """
+    已寫入排行榜的遊戲 ID 索引 (SQLite)，
+    取代每次寫入前下載整張工作表比對重複成績。
+    """
+
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS committed_games ("
+            " game_id TEXT PRIMARY KEY,"
+            " committed_at REAL NOT NULL)"
+        )
+
+    def claim(self, game_id):
+        """登記遊戲 ID；已登記過則回傳 False"""
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO committed_games (game_id, committed_at) VALUES (?, ?)",
+                (game_id, time.time())
+            )
+            return cur.rowcount == 1
+
+    def release(self, game_id):
+        """寫入失敗時撤銷登記，讓下一次提交可以重試"""
+        with self._lock:
+            self._conn.execute("DELETE FROM committed_games WHERE game_id = ?", (game_id,))
+
+    def __contains__(self, game_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM committed_games WHERE game_id = ?", (game_id,)
+            ).fetchone()
+            return row is not None
+
+
+class LeaderboardWriter:
+    """
+    排行榜背景寫入器：成績放入有上限的佇列後立即返回，
+    由背景執行緒在 flush_interval 秒內或累積 batch_size 筆後合併成一次寫入，
+    失敗時指數退避重試，結束時清空佇列。
+    佇列中與重試中的遊戲 ID 記在 _in_flight，可用 game_id in writer 查詢。
+    """
+
+    def __init__(self, sink, maxsize=1000, batch_size=50, flush_interval=2.0,
+                 max_retries=5, base_delay=1.0, max_delay=30.0,
+                 on_committed=None, on_failed=None):
+        self.sink = sink                  # sink(rows)：一次寫入多列，可回傳各列的位置 (例如工作表列號)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.on_committed = on_committed  # on_committed(game_id, row, position)，位置不明時為 None
+        self.on_failed = on_failed        # on_failed(game_id, row, exc)
+        self._queue = queue.Queue(maxsize)
+        self._in_flight_lock = threading.Lock()
+        self._in_flight = Counter()       # 已送出但尚未寫入完成或放棄的遊戲 ID
+        self._thread = threading.Thread(target=self._run, name="leaderboard-writer", daemon=True)
+        self._thread.start()
+
+    def __contains__(self, game_id):
+        with self._in_flight_lock:
+            return self._in_flight[game_id] > 0
+
+    def _settle(self, batch):
+        with self._in_flight_lock:
+            for game_id, _ in batch:
+                self._in_flight[game_id] -= 1
+                if self._in_flight[game_id] <= 0:
+                    del self._in_flight[game_id]
+
+    def submit(self, game_id, row):
+        with self._in_flight_lock:
+            self._in_flight[game_id] += 1
+        try:
+            self._queue.put_nowait((game_id, row))
+        except queue.Full:
+            # 佇列已滿時改為同步寫入，以回應時間換取不遺失成績
+            print(f"排行榜寫入佇列已滿，改為同步寫入：{game_id}")
+            self._write([(game_id, row)])
+
+    def _collect(self, first):
+        """從第一筆開始收集，直到湊滿一批、時間到或收到結束訊號"""
+        batch = [first]
+        stop = False
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                # 收到結束訊號後不再等待，直接把剩下的項目一起送出
+                self._queue.task_done()
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                self._queue.task_done()
+                return
+            batch, stop = self._collect(first)
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                self._drain()
+                return
+
+    def _drain(self):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if item is not None:
+                    self._write([item])
+            finally:
+                self._queue.task_done()
+
+    def _write(self, batch):
+        try:
+            self._write_batch(batch)
+        finally:
+            self._settle(batch)
+
+    def _write_batch(self, batch):
+        rows = [row for _, row in batch]
+        for attempt in range(self.max_retries):
+            try:
+                positions = self.sink(rows)
+                break
+            except Exception as exc:
+                if attempt == self.max_retries - 1:
+                    print(f"排行榜寫入失敗，放棄重試 {len(rows)} 筆：{exc}")
+                    if self.on_failed:
+                        for game_id, row in batch:
+                            self.on_failed(game_id, row, exc)
+                    return
+                delay = min(self.base_delay * (2 ** attempt), self.max_delay)
+                print(f"排行榜寫入失敗，{delay:.1f} 秒後重試 {len(rows)} 筆：{exc}")
+                time.sleep(delay)
+        if not isinstance(positions, list) or len(positions) != len(batch):
+            positions = [None] * len(batch)
+        if self.on_committed:
+            for (game_id, row), position in zip(batch, positions):
+                self.on_committed(game_id, row, position)
+
+    def flush(self):
+        """等待佇列中所有成績寫入完成"""
+        self._queue.join()
+
+    def close(self):
+        """送出結束訊號並等待背景執行緒把剩餘成績寫完"""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+
+class ResultSpool:
+    """
+    遊戲成績的本機 append-only 暫存檔 (JSON Lines)。
+    成績先寫入暫存檔並 fsync 後才交給排行榜後端，程序中止或 Google Sheet
+    無法使用時都不會遺失；多個同時完成的遊戲共用一次 fsync (group commit)。
+
+    <path>.ack 記錄已確認寫入後端 (或已由重播程序接手) 的遊戲 ID，
+    replay() 會把逾時仍未確認的成績重新交給後端，並把兩個檔案改寫成只剩未確認的成績
+    與仍有效的租約 (暫存檔再 os.replace)；其他 worker 下次寫入時發現檔案被換掉就重新開啟。
+    """
+
+    def __init__(self, path, commit_delay=0.002):
+        self.path = path
+        self.ack_path = path + ".ack"
+        self.commit_delay = commit_delay  # 領頭者 fsync 前等待其他寫入者加入的秒數
+        self._open_files()
+        # 多個 worker 共用暫存檔：寫入取共享鎖，重播與改寫取獨佔鎖
+        self._lock_fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        # 同一程序的執行緒共用 _lock_fd，flock 在執行緒之間不互斥，另以執行緒鎖保護
+        self._file_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+
+    def _open_files(self):
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+        self._fd = os.open(self.path, flags, 0o644)
+        self._ack_fd = os.open(self.ack_path, flags, 0o644)
+
+    def _reopen_if_replaced(self):
+        """檔案已被其他程序的 replay() 換掉時重新開啟 (須持有檔案鎖)"""
+        try:
+            replaced = (os.stat(self.path).st_ino != os.fstat(self._fd).st_ino
+                        or os.stat(self.ack_path).st_ino != os.fstat(self._ack_fd).st_ino)
+        except FileNotFoundError:
+            replaced = True
+        if replaced:
+            os.close(self._fd)
+            os.close(self._ack_fd)
+            self._open_files()
+
+    @contextmanager
+    def _locked(self, operation):
+        with self._file_lock:
+            fcntl.flock(self._lock_fd, operation)
+            try:
+                self._reopen_if_replaced()
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def append(self, game_id, record):
+        """寫入一筆成績，等到 fsync 完成才返回"""
+        line = json.dumps({"game_id": game_id, "record": record, "time": time.time()},
+                          ensure_ascii=False) + "\n"
+        with self._cond:
+            with self._locked(fcntl.LOCK_SH):
+                os.write(self._fd, line.encode("utf-8"))
+            self._written += 1
+            seq = self._written
+            while self._synced < seq:
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+                # 成為這一批的領頭者，一次 fsync 涵蓋目前所有已寫入的成績
+                self._syncing = True
+                self._cond.release()
+                try:
+                    if self.commit_delay:
+                        time.sleep(self.commit_delay)
+                    target = self._written
+                    # 先記下筆數再複製 fd：之前的寫入不是在這個檔案，就是在已 fsync 後換上的檔案中；
+                    # 複製的 fd 在檔案被換掉、原 fd 關閉後仍然有效
+                    with self._file_lock:
+                        fd = os.dup(self._fd)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                finally:
+                    self._cond.acquire()
+                    self._syncing = False
+                self._synced = max(self._synced, target)
+                self._cond.notify_all()
+
+    def _append_ack(self, entry):
+        os.write(self._ack_fd, (json.dumps(entry) + "\n").encode("utf-8"))
+
+    def ack(self, game_id):
+        """成績已確認寫入後端"""
+        with self._locked(fcntl.LOCK_SH):
+            self._append_ack({"game_id": game_id, "acked": True})
+
+    @staticmethod
+    def _read_lines(path):
+        entries = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # 寫到一半就中止的最後一行
+                    continue
+        return entries
+
+    @staticmethod
+    def _replace_file(path, entries):
+        """寫入暫存檔並 fsync 後以 os.replace 換上，中途中止時原檔案不受影響"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def replay(self, handler, min_age=300.0, lease=600.0):
+        """
+        把寫入超過 min_age 秒仍未確認的成績交給 handler(game_id, record)。
+        交出的成績在 lease 秒內不會被其他重播再交一次。回傳重播筆數。
+        """
+        due = []
+        with self._locked(fcntl.LOCK_EX):
+            now = time.time()
+            acks = self._read_lines(self.ack_path)
+            acked = set()
+            leased = {}
+            for entry in acks:
+                if entry.get("acked"):
+                    acked.add(entry["game_id"])
+                else:
+                    leased[entry["game_id"]] = entry.get("lease_until", 0)
+            entries = self._read_lines(self.path)
+            unacked = {}
+            for entry in entries:
+                if entry["game_id"] not in acked:
+                    unacked.setdefault(entry["game_id"], entry)
+            for game_id, entry in unacked.items():
+                if now - entry["time"] < min_age or leased.get(game_id, 0) > now:
+                    continue
+                leased[game_id] = now + lease
+                due.append((game_id, entry["record"]))
+            live_leases = [
+                {"game_id": game_id, "lease_until": until}
+                for game_id, until in leased.items() if game_id in unacked and until > now
+            ]
+            if len(entries) > len(unacked) or len(acks) > len(live_leases) - len(due):
+                # 有已確認的成績或過期的租約：改寫成只剩未確認的成績與有效租約，
+                # 先換成績檔，中途中止時舊的 .ack 仍涵蓋新的成績檔
+                self._replace_file(self.path, unacked.values())
+                self._replace_file(self.ack_path, live_leases)
+                self._reopen_if_replaced()
+            else:
+                for game_id, _ in due:
+                    self._append_ack({"game_id": game_id, "lease_until": leased[game_id]})
+        # 租約已記下，放開鎖再交給 handler：handler 可能同步寫入 Google Sheet，
+        # 持有獨佔鎖會擋住所有 worker 寫入暫存檔
+        for game_id, record in due:
+            handler(game_id, record)
+        return len(due)
+
+    def start_replayer(self, handler, interval=60.0, min_age=300.0):
+        """背景執行緒定期重播未確認的成績"""
+        def run():
+            while True:
+                try:
+                    replayed = self.replay(handler, min_age=min_age)
+                    if replayed:
+                        print(f"已重播 {replayed} 筆未確認的成績")
+                except Exception as exc:
+                    print(f"重播成績暫存檔失敗：{exc}")
+                time.sleep(interval)
+        thread = threading.Thread(target=run, name="result-spool-replayer", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,253 @@
+import os
+import re
+import time
+import struct
+import marshal
+import hashlib
+import threading
+from collections import OrderedDict
+from question_deck import CHOICE_ORDERS
+
+# ---------------------------------------
+# 題庫載入：QA.txt 解析一次後存成二進位快取 (marshal)，
+# 之後啟動只要讀一次快取檔，不必再逐行比對正規表示式
+#
+# 快取檔頭：magic、格式版本、QA.txt 大小、修改時間 (ns)、內容 SHA-256，
+# 之後為 marshal 資料：(題數, 題目, 正解, 錯誤選項 1, 錯誤選項 2, 出題者)，
+# 每一欄是以換行連接的單一字串 (解析時已按行切開，欄位內不會有換行)。
+# 大小與修改時間相同時直接採用快取；不同時再比對 SHA-256 (例如只被 touch 過)，
+# 內容真的改變才重新解析。
+# ---------------------------------------
+CACHE_MAGIC = b"DVQB"
+CACHE_FORMAT = 2
+CACHE_HEADER = struct.Struct("<4sHQq32s")
+VERSION_PATTERN = re.compile(r"^[0-9a-f]{16}$")
+
+QA_LINE_PATTERN = re.compile(
+    r'^\(\s*(\d+)\s*,\s*'
+    r"'([^']*)'\s*,\s*"
+    r"'([^']*)'\s*,\s*"
+    r"'([^']*)'\s*,\s*"
+    r"'([^']*)'\s*,\s*"
+    r"'([^']*)'\s*\),?"
+)
+
+
+class QuizBank:
+    """
+    欄式題庫：題目、正解、兩個錯誤選項、出題者各為一個字串清單，
+    取題時才組成 {"q", "choices", "answer", "author"}，不必為每題常駐一個 dict。
+    選項一律以原始順序保存 (第一個為正解)，由取題的人指定排列編號。
+    digest 為 QA.txt 內容的 SHA-256，version 取其前 16 碼，內容相同的題庫在各 worker 版本相同。
+    """
+
+    def __init__(self, questions=(), answers=(), wrong1=(), wrong2=(), authors=()):
+        self.digest = None
+        self.questions = list(questions)
+        self.answers = list(answers)
+        self.wrong1 = list(wrong1)
+        self.wrong2 = list(wrong2)
+        self.authors = list(authors)
+
+    @property
+    def version(self):
+        return self.digest.hex()[:16] if self.digest is not None else None
+
+    def columns(self):
+        return self.questions, self.answers, self.wrong1, self.wrong2, self.authors
+
+    def question(self, index, order=0):
+        """第 index 題，選項依 CHOICE_ORDERS[order] 排列"""
+        answer = self.answers[index]
+        choices = (answer, self.wrong1[index], self.wrong2[index])
+        return {
+            "q": self.questions[index],
+            "choices": [choices[i] for i in CHOICE_ORDERS[order]],
+            "answer": answer,
+            "author": self.authors[index]
+        }
+
+    __getitem__ = question
+
+    def __len__(self):
+        return len(self.questions)
+
+
+def parse_quiz_text(text):
+    """解析 QA.txt 內容；第一個選項為正確答案"""
+    bank = QuizBank()
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = QA_LINE_PATTERN.match(line)
+        if not match:
+            raise ValueError(f"行格式不符：{line}")
+        bank.questions.append(match.group(2))
+        bank.answers.append(match.group(3))
+        bank.wrong1.append(match.group(4))
+        bank.wrong2.append(match.group(5))
+        bank.authors.append(match.group(6))
+    return bank
+
+
+def read_cache(cache_path):
+    """一次讀入快取檔，回傳 (QA.txt 大小, 修改時間, SHA-256, marshal 資料)；沒有或格式不符時回傳 None"""
+    try:
+        with open(cache_path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < CACHE_HEADER.size:
+        return None
+    magic, fmt, size, mtime_ns, digest = CACHE_HEADER.unpack_from(data)
+    if magic != CACHE_MAGIC or fmt != CACHE_FORMAT:
+        return None
+    return size, mtime_ns, digest, memoryview(data)[CACHE_HEADER.size:]
+
+
+def encode_cache(bank):
+    return marshal.dumps((len(bank),) + tuple("\n".join(column) for column in bank.columns()))
+
+
+def decode_cache(payload):
+    try:
+        count, *columns = marshal.loads(payload)
+    except (EOFError, ValueError, TypeError):
+        return None
+    return QuizBank(*(column.split("\n") if count else [] for column in columns))
+
+
+def write_cache(cache_path, size, mtime_ns, digest, bank):
+    # 多個 worker 可能同時寫入，各自用自己的暫存檔再 os.replace
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_FORMAT, size, mtime_ns, digest))
+            f.write(encode_cache(bank))
+        os.replace(tmp_path, cache_path)
+    except OSError as exc:
+        # 唯讀的檔案系統等情況下不使用快取，不影響啟動
+        print(f"題庫快取寫入失敗：{exc}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def load_quiz_bank(file_path, cache_path=None):
+    """讀取題庫 (QuizBank)，cache_path 有設定時優先使用二進位快取"""
+    st = os.stat(file_path)
+    cache = read_cache(cache_path) if cache_path is not None else None
+    if cache is not None and cache[:2] == (st.st_size, st.st_mtime_ns):
+        bank = decode_cache(cache[3])
+        if bank is not None:
+            bank.digest = cache[2]
+            return bank
+    with open(file_path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).digest()
+    bank = None
+    if cache is not None and cache[2] == digest:
+        # 內容沒變 (只是修改時間不同)，沿用快取內容，只更新檔頭
+        bank = decode_cache(cache[3])
+    if bank is None:
+        bank = parse_quiz_text(raw.decode("utf-8"))
+    if cache_path is not None:
+        write_cache(cache_path, len(raw), st.st_mtime_ns, digest, bank)
+    bank.digest = digest
+    return bank
+
+
+class QuizBankRegistry:
+    """
+    目前的題庫與近期的舊版本，支援不重新啟動就換上新的 QA.txt：
+    背景執行緒定期檢查 QA.txt 的大小與修改時間，有變動就重新解析，
+    成功後以單一指派換上新版本 (讀取端不需加鎖)；解析失敗則繼續使用目前版本。
+
+    進行中的遊戲記住開始時的版本號，之後以 get(version) 取回同一份題庫，題號不會錯位。
+    記憶體中保留最近 keep 個版本；有設定 archive_dir 時每個版本另存一份快取檔，
+    其他 worker 或重新啟動後仍能依版本號載入。
+    """
+
+    def __init__(self, file_path, cache_path=None, archive_dir=None, keep=4):
+        self.file_path = file_path
+        self.cache_path = cache_path
+        self.archive_dir = archive_dir
+        self.keep = keep
+        self._lock = threading.Lock()     # 保護 _banks 與重新載入，讀取目前版本不需持有
+        self._banks = OrderedDict()       # 版本號 -> QuizBank
+        self._stat = None
+        self._current = None
+        if archive_dir is not None:
+            os.makedirs(archive_dir, exist_ok=True)
+        self.reload()
+
+    def current(self):
+        return self._current
+
+    def _archive_path(self, version):
+        return os.path.join(self.archive_dir, f"{version}.bank")
+
+    def _remember(self, bank):
+        self._banks[bank.version] = bank
+        self._banks.move_to_end(bank.version)
+        while len(self._banks) > self.keep:
+            self._banks.popitem(last=False)
+
+    def get(self, version):
+        """取得指定版本的題庫；已無法取得時回傳 None"""
+        current = self._current
+        if version == current.version:
+            return current
+        with self._lock:
+            bank = self._banks.get(version)
+            if bank is not None:
+                self._banks.move_to_end(version)
+                return bank
+            # 版本號來自 session，只接受 16 碼十六進位，避免被拿來組出任意路徑
+            if self.archive_dir is None or not isinstance(version, str) or not VERSION_PATTERN.match(version):
+                return None
+            cache = read_cache(self._archive_path(version))
+            bank = decode_cache(cache[3]) if cache is not None else None
+            if bank is None:
+                return None
+            bank.digest = cache[2]
+            if bank.version != version:
+                return None
+            self._remember(bank)
+            return bank
+
+    def reload(self):
+        """QA.txt 有變動時重新載入，回傳是否換上了新版本"""
+        with self._lock:
+            st = os.stat(self.file_path)
+            stat_key = (st.st_size, st.st_mtime_ns)
+            if stat_key == self._stat:
+                return False
+            # 先記下，解析失敗時等檔案再次變動才重試
+            self._stat = stat_key
+            bank = load_quiz_bank(self.file_path, self.cache_path)
+            if self._current is not None and bank.version == self._current.version:
+                return False
+            if self.archive_dir is not None:
+                path = self._archive_path(bank.version)
+                if not os.path.exists(path):
+                    write_cache(path, st.st_size, st.st_mtime_ns, bank.digest, bank)
+            self._remember(bank)
+            self._current = bank
+        print(f"題庫版本 {bank.version} 已載入，共 {len(bank)} 題")
+        return True
+
+    def start_watcher(self, interval=2.0):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reload()
+                except Exception as exc:
+                    # 編輯到一半或格式錯誤時保留目前的題庫，下次檔案變動再試
+                    print(f"題庫重新載入失敗，繼續使用版本 {self._current.version}：{exc}")
+        thread = threading.Thread(target=run, name="quiz-bank-watcher", daemon=True)
+        thread.start()
+        return thread
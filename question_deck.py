@@ -0,0 +1,67 @@
+import random
+from itertools import permutations
+
+# ---------------------------------------
+# 以種子決定的出題順序：session 只需存 (種子, 題庫大小, 游標)，
+# 不必存放整個洗牌後的題號清單，大小與題庫題數無關
+# ---------------------------------------
+MASK64 = (1 << 64) - 1
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+CHOICE_ORDERS = list(permutations(range(3)))   # 三個選項的 6 種排列，編號 0 為原始順序
+CHOICE_SALT = 0xD6E8FEB86659FD93               # 與出題順序使用不同的雜湊輸入
+
+
+def mix64(value):
+    """splitmix64 的混合函式，作為 Feistel 的輪函式"""
+    value = (value + GOLDEN_GAMMA) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+
+def new_seed():
+    return random.getrandbits(63)
+
+
+class FeistelPermutation:
+    """
+    0 ~ size-1 的偽隨機排列，perm[i] 為第 i 個位置的題號，O(1) 空間、O(1) 期望時間。
+    在 4^k (>= size) 的範圍上做平衡 Feistel 加密，結果超出 size 時再加密一次 (cycle walking)，
+    因此對 0 ~ size-1 仍是一對一。同一個 seed 永遠得到相同的排列。
+    """
+
+    def __init__(self, size, seed, rounds=4):
+        self.size = size
+        self._half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        self._mask = (1 << self._half_bits) - 1
+        self._keys = [mix64(seed ^ ((GOLDEN_GAMMA * (r + 1)) & MASK64)) for r in range(rounds)]
+
+    def _encrypt(self, value):
+        left, right = value >> self._half_bits, value & self._mask
+        for key in self._keys:
+            left, right = right, left ^ (mix64(right ^ key) & self._mask)
+        return (left << self._half_bits) | right
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        value = self._encrypt(index)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+    def __len__(self):
+        return self.size
+
+
+def draw_questions(seed, size, cursor, count):
+    """從第 cursor 個位置起取出 count 個題號；剩餘不足時回傳 None"""
+    if cursor + count > size:
+        return None
+    deck = FeistelPermutation(size, seed)
+    return [deck[i] for i in range(cursor, cursor + count)]
+
+
+def choice_order(seed, index):
+    """(遊戲種子, 題號) 對應的選項排列編號 0 ~ 5，每次計算結果相同，不需儲存"""
+    return mix64(seed ^ CHOICE_SALT ^ ((index * GOLDEN_GAMMA) & MASK64)) % len(CHOICE_ORDERS)
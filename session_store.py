@@ -0,0 +1,164 @@
+import json
+import time
+import secrets
+import sqlite3
+import threading
+from collections import OrderedDict
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+# ---------------------------------------
+# 伺服器端 session：遊戲狀態存在伺服器，cookie 只放隨機的 session ID
+# ---------------------------------------
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class MemorySessionBackend:
+    """單一程序內的 LRU session 表；多個 worker 時請改用 SQLite 或 Redis"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._items = OrderedDict()   # sid -> (到期時間, 資料)
+
+    def load(self, sid):
+        with self._lock:
+            item = self._items.get(sid)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                del self._items[sid]
+                return None
+            self._items.move_to_end(sid)
+            return item[1]
+
+    def save(self, sid, data, ttl):
+        with self._lock:
+            self._items[sid] = (time.time() + ttl, data)
+            self._items.move_to_end(sid)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._items.pop(sid, None)
+
+
+class SQLiteSessionBackend:
+    """存在本機 SQLite (WAL)，同一台機器上的所有 worker 共用"""
+
+    PURGE_INTERVAL = 300   # 每隔幾秒清除一次過期的 session
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._purged_at = 0.0
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " sid TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)")
+
+    def load(self, sid):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE sid = ? AND expires_at >= ?", (sid, time.time())
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def save(self, sid, data, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)",
+                (sid, json.dumps(data, ensure_ascii=False, separators=(",", ":")), now + ttl)
+            )
+            if now - self._purged_at >= self.PURGE_INTERVAL:
+                self._purged_at = now
+                self._conn.execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
+
+    def delete(self, sid):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+
+class RedisSessionBackend:
+    """存在 Redis 或相容的伺服器 (需另外安裝 redis 套件)，到期交給 Redis 處理"""
+
+    def __init__(self, url, prefix="drveggie:session:"):
+        import redis
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+
+    def load(self, sid):
+        data = self._redis.get(self.prefix + sid)
+        return None if data is None else json.loads(data)
+
+    def save(self, sid, data, ttl):
+        self._redis.set(self.prefix + sid, json.dumps(data, ensure_ascii=False, separators=(",", ":")),
+                        ex=max(int(ttl), 1))
+
+    def delete(self, sid):
+        self._redis.delete(self.prefix + sid)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    取代 Flask 預設的簽章 cookie session：
+    cookie 只放不可猜測的 session ID，內容只在有修改時才寫回 backend (並延長效期)。
+    ID 不需簽章，查不到 (偽造或已過期) 時視為新的空 session。
+    """
+
+    def __init__(self, backend, ttl=6 * 60 * 60):
+        self.backend = backend
+        self.ttl = ttl   # 秒，每次寫入都重新計算
+
+    @staticmethod
+    def _new_sid():
+        return secrets.token_urlsafe(24)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+        if sid:
+            data = self.backend.load(sid)
+            if data is not None:
+                return ServerSideSession(data, sid=sid)
+        return ServerSideSession(sid=self._new_sid(), new=True)
+
+    def save_session(self, app, session, response):
+        name = app.config["SESSION_COOKIE_NAME"]
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and not session.new:
+                self.backend.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+        self.backend.save(session.sid, dict(session), self.ttl)
+        # cookie 只有 ID，重新送出以延長效期的成本可忽略
+        response.set_cookie(
+            name,
+            session.sid,
+            max_age=self.ttl,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
@@ -0,0 +1,234 @@
+import os
+import json
+import time
+import base64
+import random
+import threading
+from datetime import datetime, timedelta
+import gspread
+import requests
+from gspread.exceptions import APIError, SpreadsheetNotFound, WorksheetNotFound
+from oauth2client.service_account import ServiceAccountCredentials
+
+# ---------------------------------------
+# Google Sheet 連線管理
+# ---------------------------------------
+SHEETS_SCOPE = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive"
+]
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)  # token 剩餘效期低於此值時提前更新
+
+
+def load_service_account_from_env(env_var):
+    """從環境變數讀取 base64 編碼的 service account JSON"""
+    sa_base64 = os.environ.get(env_var, "")
+    if not sa_base64:
+        raise ValueError(f"找不到環境變數 {env_var}，請先設定！")
+    sa_json = base64.b64decode(sa_base64).decode("utf-8")
+    return json.loads(sa_json)
+
+
+class SheetsClientManager:
+    """
+    整個 process 共用的 gspread 連線：
+    憑證只建立一次、token 快到期才更新、HTTP session 持續重用，
+    並快取試算表 key 與 Worksheet 物件，避免每次都重新授權與用名稱搜尋試算表。
+    """
+
+    def __init__(self, sheet_name, worksheet_name, env_var):
+        self.sheet_name = sheet_name
+        self.worksheet_name = worksheet_name
+        self.env_var = env_var
+        self._lock = threading.Lock()
+        self._client = None
+        self._spreadsheet_key = None
+        self._worksheet = None
+
+    def _build_client(self):
+        sa_dict = load_service_account_from_env(self.env_var)
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(sa_dict, SHEETS_SCOPE)
+        client = gspread.authorize(creds)
+        client.http_client.login()
+        return client
+
+    def _token_expiring(self):
+        auth = getattr(self._client.http_client, "auth", None)
+        expiry = getattr(auth, "expiry", None)
+        if auth is None or not auth.token or expiry is None:
+            return True
+        # google-auth 的 expiry 為 naive UTC 時間
+        return expiry - TOKEN_REFRESH_MARGIN <= datetime.utcnow()
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._build_client()
+            elif self._token_expiring():
+                self._client.http_client.login()
+            return self._client
+
+    @property
+    def cached_worksheet(self):
+        return self._worksheet
+
+    def worksheet(self):
+        client = self.client()
+        with self._lock:
+            if self._worksheet is not None:
+                return self._worksheet
+            if self._spreadsheet_key is None:
+                spreadsheet = client.open(self.sheet_name)
+                self._spreadsheet_key = spreadsheet.id
+            else:
+                spreadsheet = client.open_by_key(self._spreadsheet_key)
+            self._worksheet = spreadsheet.worksheet(self.worksheet_name)
+            return self._worksheet
+
+    def reset(self, keep_key=True):
+        """連線出錯時丟棄快取的 client 與 Worksheet，下次呼叫重新建立"""
+        with self._lock:
+            self._client = None
+            self._worksheet = None
+            if not keep_key:
+                self._spreadsheet_key = None
+
+
+# ---------------------------------------
+# 配額與斷路器：所有 Google Sheet 呼叫都經過 SheetsGuard
+# ---------------------------------------
+class SheetsUnavailable(Exception):
+    """斷路器開啟或本分鐘請求預算用完，暫時不呼叫 Google API"""
+
+
+# Google Sheet 暫時無法使用時可能拋出的例外
+SHEETS_ERRORS = (SheetsUnavailable, APIError, requests.exceptions.RequestException)
+
+
+def is_retryable(exc):
+    if isinstance(exc, APIError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+def reset_on_error(manager, exc):
+    """
+    授權失效 (401 / 403) 或找不到試算表、工作表 (404) 時重試無用，
+    丟棄 manager 快取的連線，下次呼叫重新建立。回傳是否已重設
+    """
+    if isinstance(exc, (SpreadsheetNotFound, WorksheetNotFound)):
+        status = 404
+    elif isinstance(exc, APIError):
+        status = exc.response.status_code
+    else:
+        return False
+    if status in (401, 403):
+        manager.reset()
+    elif status == 404:
+        # 試算表可能被刪除後重建，快取的 key 已不可靠，改回以名稱搜尋
+        manager.reset(keep_key=False)
+    else:
+        return False
+    print(f"Google Sheet 回應 {status}，下次呼叫重新建立連線")
+    return True
+
+
+class SheetsGuard:
+    """
+    包住 Google Sheet 呼叫：
+    - 每分鐘請求預算 (token bucket)，用完時直接拒絕，不再加重配額耗盡
+    - 429 / 5xx / 連線錯誤以指數退避加隨機抖動重試
+    - 連續失敗達 failure_threshold 次即開啟斷路器，reset_timeout 秒後放行一次試探
+    - 不可重試的錯誤交給 on_error(exc) (例如 reset_on_error) 後再拋出
+    """
+
+    def __init__(self, requests_per_minute=50, max_retries=3, base_delay=0.5, max_delay=8.0,
+                 failure_threshold=5, reset_timeout=30.0, on_error=None):
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_error = on_error
+        self._lock = threading.Lock()
+        self._tokens = float(requests_per_minute)
+        self._refilled_at = time.monotonic()
+        self._failures = 0
+        self._opened_at = None   # None 表示斷路器關閉
+        self._probing = False    # 半開狀態下是否已有試探請求
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+    def _before_call(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._opened_at is not None:
+                if now - self._opened_at < self.reset_timeout or self._probing:
+                    raise SheetsUnavailable("Google Sheet 斷路器開啟中")
+                self._probing = True
+            elapsed = now - self._refilled_at
+            self._tokens = min(float(self.requests_per_minute),
+                               self._tokens + elapsed * self.requests_per_minute / 60.0)
+            self._refilled_at = now
+            if self._tokens < 1:
+                self._probing = False
+                raise SheetsUnavailable("Google Sheet 每分鐘請求預算已用完")
+            self._tokens -= 1
+
+    def _on_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def _on_failure(self):
+        """回傳斷路器是否因此開啟"""
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(f"Google Sheet 連續失敗 {self._failures} 次，斷路器開啟 {self.reset_timeout:.0f} 秒")
+                self._opened_at = time.monotonic()
+                self._probing = False
+                return True
+            return False
+
+    def call(self, fn, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self._before_call()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as exc:
+                if not is_retryable(exc):
+                    with self._lock:
+                        self._probing = False
+                    if self.on_error:
+                        self.on_error(exc)
+                    raise
+                if self._on_failure() or attempt == self.max_retries:
+                    raise
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt))))
+                continue
+            self._on_success()
+            return result
+
+
+class GuardedWorksheet:
+    """把 Worksheet 的每個方法呼叫都交給 SheetsGuard 執行"""
+
+    def __init__(self, worksheet, guard):
+        self._worksheet = worksheet
+        self._guard = guard
+
+    def __getattr__(self, name):
+        attr = getattr(self._worksheet, name)
+        if not callable(attr):
+            return attr
+
+        def guarded(*args, **kwargs):
+            return self._guard.call(attr, *args, **kwargs)
+        return guarded